@@ -0,0 +1,301 @@
+"""就活管理アプリ — 選考ファネルの集計.
+
+SELECTION_STAGES の順に企業がどこまで進んだかを，オブジェクトを読み込まずに
+GROUP BY とウィンドウ関数の SQL で集計する．
+
+* funnel: 各段階に到達した社数と次の段階への通過率（到達数は段階の降順の累積和）
+* outcomes: 段階 × 業界ごとの合格・不合格・辞退・未確定の件数
+* stage_intervals: 段階間の日数の中央値（LAG で直前の段階との差を取り，ROW_NUMBER で中央を選ぶ）
+* entry_sheets: ES のステータス別件数と合格率
+
+結果は「companies / selections / entry_sheets の版数（DataVersion）」をキーに
+プロセス内へキャッシュする．選考・ES を書き込むと版数が進むので，次の参照で集計し直す．
+"""
+
+import codecs
+import csv
+import io
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func
+
+from models import (
+    ES_STATUSES,
+    SELECTION_STAGES,
+    Company,
+    EntrySheet,
+    Selection,
+    User,
+    db,
+    get_versions,
+)
+
+SCOPES = ("companies", "selections", "entry_sheets")
+PASSED = ("合格", "内定")
+FAILED = ("不合格",)
+DECLINED = ("辞退",)
+CACHE_SIZE = 256
+
+_cache = OrderedDict()  # (user_id, 版数タグ) → 集計結果
+_lock = threading.Lock()
+
+
+# ------------------------------------------------------------------
+# SQL の部品
+# ------------------------------------------------------------------
+def _stage_order():
+    """段階の並び順（SELECTION_STAGES の位置．一覧に無い段階は -1）."""
+    return case(
+        {stage: i for i, stage in enumerate(SELECTION_STAGES)}, value=Selection.stage, else_=-1
+    )
+
+
+def _count_if(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def _days_between(later, earlier):
+    if db.engine.dialect.name == "sqlite":
+        return func.julianday(later) - func.julianday(earlier)
+    return func.extract("epoch", later - earlier) / 86400.0
+
+
+# ------------------------------------------------------------------
+# 集計
+# ------------------------------------------------------------------
+def _funnel(user_id):
+    order = _stage_order()
+    furthest = (
+        db.select(func.max(order).label("stage_order"))
+        .join(Company, Company.id == Selection.company_id)
+        .where(Company.user_id == user_id)
+        .group_by(Selection.company_id)
+        .subquery()
+    )
+    per_stage = (
+        db.select(furthest.c.stage_order, func.count().label("companies"))
+        .where(furthest.c.stage_order >= 0)
+        .group_by(furthest.c.stage_order)
+        .subquery()
+    )
+    # その段階以降まで進んだ社数 = 最も進んだ段階ごとの社数の降順の累積和
+    rows = db.session.execute(
+        db.select(
+            per_stage.c.stage_order,
+            func.sum(per_stage.c.companies).over(order_by=per_stage.c.stage_order.desc()),
+        )
+    ).all()
+    reached_at = {stage_order: int(reached) for stage_order, reached in rows}
+
+    reached = [0] * len(SELECTION_STAGES)
+    carry = 0
+    for i in reversed(range(len(SELECTION_STAGES))):
+        carry = reached_at.get(i, carry)
+        reached[i] = carry
+    funnel = []
+    for i, stage in enumerate(SELECTION_STAGES):
+        following = reached[i + 1] if i + 1 < len(reached) else None
+        conversion = None
+        if following is not None and reached[i]:
+            conversion = round(following / reached[i], 3)
+        funnel.append({"stage": stage, "reached": reached[i], "conversion": conversion})
+    return funnel
+
+
+def _outcomes(user_id):
+    order = _stage_order()
+    rows = db.session.execute(
+        db.select(
+            Selection.stage,
+            Company.industry,
+            func.count(),
+            _count_if(Selection.status.in_(PASSED)),
+            _count_if(Selection.status.in_(FAILED)),
+            _count_if(Selection.status.in_(DECLINED)),
+        )
+        .join(Company, Company.id == Selection.company_id)
+        .where(Company.user_id == user_id)
+        .group_by(Selection.stage, Company.industry)
+        .order_by(func.min(order), Company.industry)
+    )
+    return [
+        {
+            "stage": stage,
+            "industry": industry or "未設定",
+            "total": total,
+            "passed": int(passed),
+            "failed": int(failed),
+            "declined": int(declined),
+            "pending": total - int(passed) - int(failed) - int(declined),
+        }
+        for stage, industry, total, passed, failed, declined in rows
+    ]
+
+
+def _stage_intervals(user_id):
+    order = _stage_order()
+    window = {"partition_by": Selection.company_id, "order_by": (order, Selection.scheduled_at)}
+    ordered = (
+        db.select(
+            Selection.stage.label("stage"),
+            order.label("stage_order"),
+            Selection.scheduled_at.label("at"),
+            func.lag(Selection.stage).over(**window).label("prev_stage"),
+            func.lag(Selection.scheduled_at).over(**window).label("prev_at"),
+        )
+        .join(Company, Company.id == Selection.company_id)
+        .where(Company.user_id == user_id, Selection.scheduled_at.isnot(None), order >= 0)
+        .subquery()
+    )
+    gaps = (
+        db.select(
+            ordered.c.prev_stage,
+            ordered.c.stage,
+            ordered.c.stage_order,
+            _days_between(ordered.c.at, ordered.c.prev_at).label("days"),
+        )
+        .where(ordered.c.prev_at.isnot(None), ordered.c.prev_stage != ordered.c.stage)
+        .subquery()
+    )
+    pair = (gaps.c.prev_stage, gaps.c.stage)
+    ranked = db.select(
+        gaps,
+        func.row_number().over(partition_by=pair, order_by=gaps.c.days).label("rn"),
+        func.count().over(partition_by=pair).label("n"),
+    ).subquery()
+    # 件数が奇数なら中央の 1 件，偶数なら中央の 2 件の平均
+    rows = db.session.execute(
+        db.select(
+            ranked.c.prev_stage,
+            ranked.c.stage,
+            func.avg(ranked.c.days),
+            func.max(ranked.c.n),
+        )
+        .where(ranked.c.rn.between((ranked.c.n + 1) // 2, (ranked.c.n + 2) // 2))
+        .group_by(ranked.c.prev_stage, ranked.c.stage)
+        .order_by(func.min(ranked.c.stage_order), ranked.c.prev_stage)
+    )
+    return [
+        {"from": prev, "to": stage, "median_days": round(float(days), 1), "samples": samples}
+        for prev, stage, days, samples in rows
+    ]
+
+
+def _entry_sheets(user_id):
+    counts = dict.fromkeys(ES_STATUSES, 0)
+    counts.update(
+        db.session.execute(
+            db.select(EntrySheet.status, func.count())
+            .join(Company, Company.id == EntrySheet.company_id)
+            .where(Company.user_id == user_id)
+            .group_by(EntrySheet.status)
+        ).all()
+    )
+    decided = counts["合格"] + counts["不合格"]
+    return {
+        "counts": counts,
+        "submitted": counts["提出済み"] + decided,
+        "pass_rate": round(counts["合格"] / decided, 3) if decided else None,
+    }
+
+
+def version_tag(user_id):
+    """集計の元データの版数（ETag・キャッシュのキー．主キー検索 1 回）."""
+    versions = get_versions(user_id, *SCOPES)
+    return "analytics-" + "-".join(str(versions[scope]) for scope in SCOPES)
+
+
+def selection_funnel(user_id, tag=None):
+    """選考ファネルの集計結果（版数が変わるまでプロセス内のキャッシュを返す）."""
+    tag = tag or version_tag(user_id)
+    key = (user_id, tag)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    report = {
+        "version": tag,
+        "funnel": _funnel(user_id),
+        "outcomes": _outcomes(user_id),
+        "stage_intervals": _stage_intervals(user_id),
+        "entry_sheets": _entry_sheets(user_id),
+    }
+    with _lock:
+        _cache[key] = report
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return report
+
+
+# ------------------------------------------------------------------
+# 出力（CSV・PDF）
+# ------------------------------------------------------------------
+def _percent(rate):
+    return "—" if rate is None else f"{rate * 100:.1f}%"
+
+
+def report_sections(report):
+    """(見出し, ヘッダ, 行) の組を返す（CSV と PDF で共通）."""
+    yield (
+        "選考ファネル",
+        ["段階", "到達社数", "次の段階への通過率"],
+        [[row["stage"], row["reached"], _percent(row["conversion"])] for row in report["funnel"]],
+    )
+    yield (
+        "段階・業界別の結果",
+        ["段階", "業界", "件数", "合格", "不合格", "辞退", "未確定"],
+        [
+            [r["stage"], r["industry"], r["total"], r["passed"], r["failed"], r["declined"], r["pending"]]
+            for r in report["outcomes"]
+        ],
+    )
+    yield (
+        "段階間の日数（中央値）",
+        ["前の段階", "次の段階", "日数", "件数"],
+        [[r["from"], r["to"], r["median_days"], r["samples"]] for r in report["stage_intervals"]],
+    )
+    es = report["entry_sheets"]
+    yield (
+        "ES のステータス",
+        ["ステータス", "件数"],
+        [[status, count] for status, count in es["counts"].items()]
+        + [["提出数", es["submitted"]], ["合格率", _percent(es["pass_rate"])]],
+    )
+
+
+def report_csv(report):
+    """集計結果を CSV（セクションごとに見出し行と空行で区切る）で少しずつ返す."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    yield codecs.BOM_UTF8.decode("utf-8")  # Excel で文字化けしないよう BOM を付ける
+    for title, header, rows in report_sections(report):
+        writer.writerow([title])
+        writer.writerow(header)
+        writer.writerows(rows)
+        writer.writerow([])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def funnel_document(user_id):
+    """選考ファネル分析の PDF（reports.py から使う）."""
+    from generate_manual_pdf import Document
+
+    now = datetime.utcnow() + timedelta(hours=9)
+    user = db.session.get(User, user_id)
+    doc = Document(header_text="Syu_katsu — 選考ファネル分析")
+    doc.set_auto_page_break(auto=True, margin=20)
+    doc.add_page()
+    doc.section("選考ファネル分析")
+    doc.body_text(f"{user.name} さん／作成日時: {now:%Y年%m月%d日 %H:%M}")
+    for title, header, rows in report_sections(selection_funnel(user_id)):
+        doc.subsection(title)
+        doc.table_row(header, header=True)
+        for row in rows:
+            doc.table_row([str(value) for value in row])
+        if not rows:
+            doc.body_text("データがありません．")
+    return doc
@@ -1,22 +1,48 @@
 """就活管理アプリ — Flask メインアプリケーション."""
 
+import base64
+import csv
+import json
 import os
-from datetime import datetime, timezone
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 
+import click
 from flask import (
     Blueprint,
     Flask,
     Response,
+    abort,
+    current_app,
+    g,
     jsonify,
     redirect,
     render_template,
     request,
+    send_file,
+    stream_with_context,
     url_for,
 )
-
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+import analytics
+import bulk
+import ics
+import revisions
+from assets import init_assets
 from config import Config, RESOURCE_DIR
+from encryption import reencrypt_column
+from instrumentation import init_instrumentation
+from page_cache import cached_page, init_page_cache
+from reminders import init_reminders
+from reports import REPORT_KINDS, init_reports
+from schema import backfill_current_selection, init_database, schema_is_current
+from search import init_search, rebuild_search_index, search
 from models import (
+    ES_STATUSES,
     EVENT_TYPES,
     SELECTION_STAGES,
     SELECTION_STATUSES,
@@ -25,19 +51,26 @@ from models import (
     InterviewNote,
     JobAxis,
     Schedule,
+    ScheduleTombstone,
     Selection,
     User,
     db,
+    get_version_rows,
+    get_versions,
 )
 
 # ==================================================================
 # Blueprint 定義 — ルートを create_app() の外に定義
 # ==================================================================
-main_bp = Blueprint("main", __name__)
+main_bp = Blueprint("main", __name__, cli_group=None)
 
 
 def _parse_datetime(value):
-    """文字列を datetime に変換."""
+    """文字列を datetime に変換.
+
+    FullCalendar のドラッグ操作はオフセット付き（"...T10:00:00+09:00"）で送るため，
+    その場合はタイムゾーン情報を落として naive な現地時刻にする．
+    """
     if not value:
         return None
     for fmt in ("%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
@@ -45,16 +78,89 @@ def _parse_datetime(value):
             return datetime.strptime(value, fmt)
         except ValueError:
             continue
-    return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _parse_range_bound(value):
+    """FullCalendar の start/end パラメータ（ISO 8601, オフセット付き）を変換.
+
+    DB は naive な現地時刻で保存しているため，タイムゾーン情報は落とす．
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return _parse_datetime(value)
+
+
+# ------------------------------------------------------------------
+# 現在のユーザー（シングルユーザー運用）
+# ------------------------------------------------------------------
+# プロセス内キャッシュ（USER_CACHE_TTL > 0 のときのみ）: detached なスナップショットを保持して
+# 毎リクエストの SELECT を省く．破棄は同じプロセス内の書き込みでしか起きないため，
+# 複数ワーカーでは他のワーカーの変更（カレンダー購読トークンの再発行など）が最大 TTL 秒遅れる．
+_user_cache = {"user": None, "loaded_at": 0.0}
+
+
+def _invalidate_user_cache(*_args):
+    """users テーブルが変更されたらプロセス内キャッシュを破棄する."""
+    _user_cache["user"] = None
+
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(User, _event_name, _invalidate_user_cache)
+
+
+def _snapshot_user(user):
+    """セッションから切り離したユーザーのコピーを作る（キャッシュ保持用）."""
+    columns = {attr.key: getattr(user, attr.key) for attr in sa_inspect(User).column_attrs}
+    snapshot = User(**columns)
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def _resolve_current_user():
+    """現在のユーザーを返す．キャッシュが有効ならDBに問い合わせない."""
+    ttl = current_app.config.get("USER_CACHE_TTL", 0)
+    cached = _user_cache["user"]
+    if ttl > 0 and cached is not None and time.monotonic() - _user_cache["loaded_at"] < ttl:
+        # load=False でセッションに載せる（SELECT を発行しない）
+        return db.session.merge(cached, load=False)
+
+    user = User.query.order_by(User.id).first()
+    if ttl > 0 and user is not None:
+        _user_cache["user"] = _snapshot_user(user)
+        _user_cache["loaded_at"] = time.monotonic()
+    return user
+
+
+@main_bp.before_request
+def load_current_user():
+    """リクエストごとに 1 回だけユーザーを解決し g.user に置く."""
+    g.user = _resolve_current_user()
+
+
+# 一覧では表示しない長文の列（企業の説明・メモ）は読み込まない
+_COMPANY_LIST_OPTIONS = (db.defer(Company.description), db.defer(Company.notes))
 
 
 # ------------------------------------------------------------------
 # ダッシュボード
 # ------------------------------------------------------------------
 @main_bp.route("/")
+@cached_page("companies:{user_id}", "schedules:{user_id}")
 def dashboard():
-    user = User.query.first()
-    companies = Company.query.filter_by(user_id=user.id).order_by(Company.preference.desc()).all()
+    user = g.user
+    companies = (
+        Company.query.filter_by(user_id=user.id)
+        .options(*_COMPANY_LIST_OPTIONS)
+        .order_by(Company.preference.desc())
+        .all()
+    )
 
     # 日本時間（JST）基準で現在時刻を取得（DBはnaive datetimeで保存されているため）
     from datetime import date, timedelta
@@ -65,6 +171,7 @@ def dashboard():
         Schedule.query.filter_by(user_id=user.id)
         .filter(Schedule.start_at >= now_jst)
         .filter(Schedule.event_type.notin_(["その他", "ES締め切り"]))
+        .options(db.joinedload(Schedule.company))
         .order_by(Schedule.start_at)
         .limit(5)
         .all()
@@ -80,7 +187,13 @@ def dashboard():
     )
     today = date.today()
 
-    # 企業を最新の選考段階でグループ分け
+    # キャッシュは「直近のイベント」の先頭が始まる時刻か日付が変わる時刻までで期限切れにする
+    midnight = datetime.combine(today + timedelta(days=1), datetime.min.time())
+    changes_at = [ev.start_at - now_jst for ev in (upcoming[:1] + es_events[:1])]
+    changes_at.append(midnight - datetime.now())
+    g.page_cache_ttl = max(min(changes_at).total_seconds(), 0)
+
+    # 企業を最新の選考段階でグループ分け（非正規化した current_stage を参照）
     company_groups = {
         "エントリー開始待ち": [],
         "エントリー": [],
@@ -89,16 +202,15 @@ def dashboard():
         "選考中": [],
     }
     for c in companies:
-        latest = c.latest_selection
-        if not latest:
+        if not c.current_stage:
             company_groups["エントリー開始待ち"].append(c)
-        elif latest.stage == "エントリー開始待ち":
+        elif c.current_stage == "エントリー開始待ち":
             company_groups["エントリー開始待ち"].append(c)
-        elif latest.stage == "エントリー":
+        elif c.current_stage == "エントリー":
             company_groups["エントリー"].append(c)
-        elif latest.stage == "書類選考":
+        elif c.current_stage == "書類選考":
             company_groups["書類選考"].append(c)
-        elif latest.stage == "適性検査":
+        elif c.current_stage == "適性検査":
             company_groups["適性検査"].append(c)
         else:
             company_groups["選考中"].append(c)
@@ -118,19 +230,72 @@ def dashboard():
 # 企業管理
 # ------------------------------------------------------------------
 @main_bp.route("/companies")
+@cached_page("companies:{user_id}")
 def company_list():
-    user = User.query.first()
-    companies = (
-        Company.query.filter_by(user_id=user.id)
-        .order_by(Company.preference.desc())
-        .all()
+    user = g.user
+    industry = request.args.get("industry", "")
+    stage = request.args.get("stage", "")
+    per_page = _page_size()
+
+    query = Company.query.filter_by(user_id=user.id).options(*_COMPANY_LIST_OPTIONS)
+    if industry:
+        query = query.filter(Company.industry == industry)
+    if stage == "未応募":
+        query = query.filter(Company.current_stage.is_(None))
+    elif stage:
+        query = query.filter(Company.current_stage == stage)
+    total = _count(query, Company.id)
+
+    # キーセットページング: (preference 降順, id 昇順) の直前の位置から続きを取る
+    cursor = _decode_cursor(request.args.get("after"), 2)
+    if cursor:
+        last_pref, last_id = cursor
+        query = query.filter(
+            db.or_(
+                Company.preference < last_pref,
+                db.and_(Company.preference == last_pref, Company.id > last_id),
+            )
+        )
+    rows = query.order_by(Company.preference.desc(), Company.id).limit(per_page + 1).all()
+    companies = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = companies[-1]
+        next_cursor = _encode_cursor([last.preference, last.id])
+
+    # 選考件数は企業ごとに lazy load せず GROUP BY でまとめて取得（表示中のページ分のみ）
+    selection_counts = dict(
+        db.session.execute(
+            db.select(Selection.company_id, db.func.count(Selection.id))
+            .where(Selection.company_id.in_([c.id for c in companies]))
+            .group_by(Selection.company_id)
+        ).all()
+    )
+    industries = [
+        row[0]
+        for row in db.session.execute(
+            db.select(Company.industry)
+            .where(Company.user_id == user.id, Company.industry.isnot(None), Company.industry != "")
+            .distinct()
+            .order_by(Company.industry)
+        )
+    ]
+    return render_template(
+        "companies.html",
+        companies=companies,
+        selection_counts=selection_counts,
+        total=total,
+        next_cursor=next_cursor,
+        per_page=per_page,
+        industries=industries,
+        stages=SELECTION_STAGES,
+        filters={"industry": industry, "stage": stage},
     )
-    return render_template("companies.html", companies=companies)
 
 
 @main_bp.route("/companies/new", methods=["GET", "POST"])
 def company_new():
-    user = User.query.first()
+    user = g.user
     if request.method == "POST":
         company = Company(
             user_id=user.id,
@@ -151,8 +316,10 @@ def company_new():
 
 
 @main_bp.route("/companies/<int:company_id>")
+@cached_page("company:{company_id}")
 def company_detail(company_id):
-    company = Company.query.get_or_404(company_id)
+    # パスワードは復号せず有無だけを読む（表示時に company_mypage_password から取得）
+    company = Company.query.options(db.undefer(Company.has_mypage_password)).get_or_404(company_id)
     axes = JobAxis.query.filter_by(user_id=company.user_id).all()
     # scheduled_at が None でもソートできるよう、Noneを最後に配置
     selections_sorted = sorted(
@@ -169,6 +336,15 @@ def company_detail(company_id):
     )
 
 
+@main_bp.route("/companies/<int:company_id>/mypage-password")
+def company_mypage_password(company_id):
+    """マイページのパスワードを復号して返す（詳細画面で「表示」を押した時だけ呼ばれる）."""
+    company = Company.query.get_or_404(company_id)
+    response = jsonify({"password": company.mypage_password or ""})
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
 @main_bp.route("/companies/<int:company_id>/edit", methods=["GET", "POST"])
 def company_edit(company_id):
     company = Company.query.get_or_404(company_id)
@@ -200,7 +376,7 @@ def company_delete(company_id):
 # ------------------------------------------------------------------
 @main_bp.route("/companies/<int:company_id>/selections/new", methods=["POST"])
 def selection_new(company_id):
-    Company.query.get_or_404(company_id)
+    company = Company.query.get_or_404(company_id)
     sel = Selection(
         company_id=company_id,
         stage=request.form.get("stage", "エントリー"),
@@ -210,6 +386,7 @@ def selection_new(company_id):
         feedback=request.form.get("feedback", ""),
     )
     db.session.add(sel)
+    company.refresh_current_selection()
     db.session.commit()
     return redirect(url_for("main.company_detail", company_id=company_id))
 
@@ -222,6 +399,7 @@ def selection_update(sel_id):
     sel.scheduled_at = _parse_datetime(request.form.get("scheduled_at")) or sel.scheduled_at
     sel.location = request.form.get("location", sel.location)
     sel.feedback = request.form.get("feedback", sel.feedback)
+    sel.company.refresh_current_selection()
     db.session.commit()
     return redirect(url_for("main.company_detail", company_id=sel.company_id))
 
@@ -230,7 +408,9 @@ def selection_update(sel_id):
 def selection_delete(sel_id):
     sel = Selection.query.get_or_404(sel_id)
     cid = sel.company_id
+    company = sel.company
     db.session.delete(sel)
+    company.refresh_current_selection()
     db.session.commit()
     return redirect(url_for("main.company_detail", company_id=cid))
 
@@ -240,43 +420,114 @@ def selection_delete(sel_id):
 # ------------------------------------------------------------------
 @main_bp.route("/calendar")
 def calendar_view():
-    return render_template("calendar.html", event_types=EVENT_TYPES)
+    token = g.user.calendar_token
+    feed_url = url_for("main.calendar_feed", token=token, _external=True) if token else None
+    return render_template("calendar.html", event_types=EVENT_TYPES, feed_url=feed_url)
+
+
+# _event_json の形式（項目・EVENT_COLORS）を変えたら上げる．ETag に含めるため，
+# デプロイ前の ETag を持つクライアントにも 304 ではなく新しい形式を返す
+EVENT_JSON_VERSION = 1
+EVENT_COLORS = {
+    "説明会": "#6366f1",
+    "ES締め切り": "#f59e0b",
+    "面接": "#ef4444",
+    "その他": "#64748b",
+}
+
+
+def _event_json(s, company_name):
+    """FullCalendar のイベント形式に変換する."""
+    color = EVENT_COLORS.get(s.event_type, "#64748b")
+    return {
+        "id": s.id,
+        "title": s.title,
+        "start": s.start_at.isoformat() if s.start_at else None,
+        "end": s.end_at.isoformat() if s.end_at else None,
+        "backgroundColor": color,
+        "borderColor": color,
+        "extendedProps": {
+            "event_type": s.event_type,
+            "location_or_url": s.location_or_url or "",
+            "company_name": company_name or "",
+            "company_id": s.company_id,
+            "reminder": bool(s.reminder),
+        },
+    }
+
+
+def _not_modified(etag):
+    """If-None-Match が一致すれば 304 レスポンスを返す（一致しなければ None）."""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+    return None
+
+
+def _with_etag(response, etag):
+    """弱い ETag を付け，毎回再検証させる（変更がなければ 304 で返る）."""
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @main_bp.route("/api/events")
 def api_events():
-    user = User.query.first()
-    schedules = Schedule.query.filter_by(user_id=user.id).all()
-    events = []
-    color_map = {
-        "説明会": "#6366f1",
-        "ES締め切り": "#f59e0b",
-        "面接": "#ef4444",
-        "その他": "#64748b",
-    }
-    for s in schedules:
-        events.append(
-            {
-                "id": s.id,
-                "title": s.title,
-                "start": s.start_at.isoformat() if s.start_at else None,
-                "end": s.end_at.isoformat() if s.end_at else None,
-                "backgroundColor": color_map.get(s.event_type, "#64748b"),
-                "borderColor": color_map.get(s.event_type, "#64748b"),
-                "extendedProps": {
-                    "event_type": s.event_type,
-                    "location_or_url": s.location_or_url or "",
-                    "company_name": s.company.name if s.company else "",
-                    "company_id": s.company_id,
-                },
-            }
+    user = g.user
+    # 予定・企業名の版数が変わっていなければ行を読まずに 304 を返す
+    versions = get_versions(user.id, "schedules", "companies")
+    etag = f"events-v{EVENT_JSON_VERSION}-{versions['schedules']}-{versions['companies']}"
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    query = Schedule.query.filter_by(user_id=user.id)
+
+    # FullCalendar は表示中の期間を start/end で送ってくるので，
+    # その期間と重なるイベントだけを (user_id, start_at) インデックスで取得する
+    range_start = _parse_range_bound(request.args.get("start"))
+    range_end = _parse_range_bound(request.args.get("end"))
+    if range_start and range_end:
+        # 期間内に始まるイベント + 期間より前に始まり期間内まで続く複数日イベント
+        # （OR の両辺がそれぞれ start_at / end_at のインデックスで絞り込める形にする）
+        query = query.filter(
+            db.or_(
+                db.and_(Schedule.start_at >= range_start, Schedule.start_at < range_end),
+                db.and_(Schedule.end_at >= range_start, Schedule.start_at < range_end),
+            )
         )
-    return jsonify(events)
+    elif range_start:
+        query = query.filter(
+            db.or_(Schedule.start_at >= range_start, Schedule.end_at >= range_start)
+        )
+    elif range_end:
+        query = query.filter(Schedule.start_at < range_end)
+    # 企業名は行ごとの lazy load ではなく外部結合で同じクエリから取る
+    rows = (
+        query.outerjoin(Company, Company.id == Schedule.company_id)
+        .add_columns(Company.name)
+        .all()
+    )
+    events = [_event_json(s, company_name) for s, company_name in rows]
+    return _with_etag(jsonify(events), etag)
+
+
+def _notify_reminders(schedule, deleted=False):
+    """リマインダーのスケジューラ（有効時のみ）にイベントの変更を伝える."""
+    scheduler = current_app.extensions.get("reminders")
+    if scheduler is None:
+        return
+    if deleted:
+        scheduler.forget(schedule.id)
+    else:
+        scheduler.notify(schedule.id, schedule.start_at, schedule.reminder)
 
 
 @main_bp.route("/api/events", methods=["POST"])
 def api_event_create():
-    user = User.query.first()
+    user = g.user
     data = request.get_json()
     schedule = Schedule(
         user_id=user.id,
@@ -286,9 +537,11 @@ def api_event_create():
         start_at=_parse_datetime(data.get("start")),
         end_at=_parse_datetime(data.get("end")),
         location_or_url=data.get("location_or_url", ""),
+        reminder=bool(data.get("reminder", False)),
     )
     db.session.add(schedule)
     db.session.commit()
+    _notify_reminders(schedule)
     return jsonify({"id": schedule.id}), 201
 
 
@@ -308,7 +561,13 @@ def api_event_update(event_id):
         schedule.location_or_url = data["location_or_url"]
     if "company_id" in data:
         schedule.company_id = data["company_id"] or None
+    if "reminder" in data:
+        schedule.reminder = bool(data["reminder"])
+    # 日時の変更・リマインダーの再設定があれば再通知できるよう送信記録を消す
+    if "start" in data or data.get("reminder"):
+        schedule.reminded_at = None
     db.session.commit()
+    _notify_reminders(schedule)
     return jsonify({"ok": True})
 
 
@@ -317,15 +576,312 @@ def api_event_delete(event_id):
     schedule = Schedule.query.get_or_404(event_id)
     db.session.delete(schedule)
     db.session.commit()
+    _notify_reminders(schedule, deleted=True)
     return jsonify({"ok": True})
 
 
+# 1 回の batch で受け付ける操作の上限
+BATCH_MAX_OPERATIONS = 500
+
+
+# batch の data で文字列のみを受け付ける項目
+_EVENT_TEXT_FIELDS = ("title", "event_type", "start", "end", "location_or_url")
+
+
+def _operation_errors(op):
+    """batch の 1 件の形の検査（id は整数，data はオブジェクト，文字列の項目は文字列）."""
+    errors = []
+    op_id = op.get("id")
+    if op_id is not None and (isinstance(op_id, bool) or not isinstance(op_id, int)):
+        errors.append("id は整数で指定してください")
+    data = op.get("data")
+    if data is None:
+        return errors
+    if not isinstance(data, dict):
+        errors.append("data はオブジェクトで指定してください")
+        return errors
+    for field in _EVENT_TEXT_FIELDS:
+        if data.get(field) is not None and not isinstance(data[field], str):
+            errors.append(f"{field} は文字列で指定してください")
+    return errors
+
+
+def _parse_company_id(value):
+    """company_id を int にする（"3" のような文字列も受け付ける．未指定は None，不正なら ValueError）."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(value)
+    return int(value)
+
+
+def _event_values(data, company_ids, partial):
+    """batch の 1 件分の JSON を Schedule の列の値に変換する.
+
+    partial（update）のときは data にある項目だけを返す．(値の dict, エラーのリスト) を返す．
+    """
+    values, errors = {}, []
+    if "title" in data or not partial:
+        values["title"] = (data.get("title") or "").strip()
+        if not values["title"]:
+            errors.append("title は必須です")
+    if "event_type" in data or not partial:
+        values["event_type"] = data.get("event_type") or "その他"
+        if values["event_type"] not in EVENT_TYPES:
+            errors.append(f"event_type「{values['event_type']}」は種別の一覧にありません")
+    if "start" in data or not partial:
+        values["start_at"] = _parse_datetime(data.get("start"))
+        if values["start_at"] is None:
+            errors.append("start が未指定か不正です")
+    if "end" in data:
+        values["end_at"] = _parse_datetime(data["end"])
+        if data["end"] and values["end_at"] is None:
+            errors.append("end の日時が不正です")
+    if "location_or_url" in data:
+        values["location_or_url"] = data["location_or_url"] or ""
+    if "company_id" in data:
+        try:
+            values["company_id"] = _parse_company_id(data["company_id"])
+        except ValueError:
+            errors.append("company_id は整数で指定してください")
+        else:
+            if values["company_id"] is not None and values["company_id"] not in company_ids:
+                errors.append(f"company_id {values['company_id']} の企業がありません")
+    if "reminder" in data:
+        values["reminder"] = bool(data["reminder"])
+    return values, errors
+
+
+@main_bp.route("/api/events/batch", methods=["POST"])
+def api_events_batch():
+    """イベントの作成・更新・削除をまとめて 1 トランザクション（commit 1 回）で適用する.
+
+    リクエスト: {"operations": [{"op": "create" | "update" | "delete", "id": ..., "data": {...}}],
+                 "atomic": false}
+    レスポンス: {"results": [操作ごとの結果], "events": [作成・更新したイベント], "deleted": [id]}
+    失敗した操作は results に errors を付けて飛ばし，残りを適用する．
+    atomic が true なら 1 件でも失敗したときに何も適用せず 409 を返す．
+    """
+    user = g.user
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get("operations")
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations を指定してください"}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({"error": f"operations は {BATCH_MAX_OPERATIONS} 件までです"}), 400
+    operations = [op if isinstance(op, dict) else {} for op in operations]
+    shape_errors = [_operation_errors(op) for op in operations]
+    valid = [op for op, errors in zip(operations, shape_errors) if not errors]
+
+    # 対象のイベント・企業は操作ごとではなくまとめて 1 回ずつ読む
+    target_ids = {op.get("id") for op in valid if op.get("op") in ("update", "delete")}
+    schedules = {}
+    if target_ids:
+        schedules = {
+            s.id: s
+            for s in Schedule.query.filter(
+                Schedule.user_id == user.id, Schedule.id.in_(target_ids)
+            )
+        }
+    requested_companies = set()
+    for op in valid:
+        try:
+            requested_companies.add(_parse_company_id((op.get("data") or {}).get("company_id")))
+        except ValueError:
+            continue  # 操作ごとのエラーとして _event_values が返す
+    requested_companies.discard(None)
+    company_ids = set()
+    if requested_companies:
+        company_ids = set(
+            db.session.execute(
+                db.select(Company.id).where(
+                    Company.user_id == user.id, Company.id.in_(requested_companies)
+                )
+            ).scalars()
+        )
+
+    results = []
+    changed = {}  # id → Schedule（作成・更新）
+    deleted = []
+    for index, op in enumerate(operations):
+        kind = op.get("op")
+        result = {"index": index, "op": kind, "ok": False}
+        if "ref" in op:
+            result["ref"] = op["ref"]  # クライアント側の仮 id など（そのまま返す）
+        results.append(result)
+        if shape_errors[index]:
+            result["errors"] = shape_errors[index]
+            continue
+        data = op.get("data") or {}
+
+        if kind == "create":
+            values, errors = _event_values(data, company_ids, partial=False)
+            schedule = Schedule(user_id=user.id, **values)
+        elif kind in ("update", "delete"):
+            schedule = schedules.get(op.get("id"))
+            result["id"] = op.get("id")
+            if schedule is None or schedule in deleted:
+                result["errors"] = ["イベントがありません"]
+                continue
+            if kind == "delete":
+                db.session.delete(schedule)
+                deleted.append(schedule)
+                result["ok"] = True
+                continue
+            values, errors = _event_values(data, company_ids, partial=True)
+        else:
+            result["errors"] = ["op は create / update / delete のいずれかです"]
+            continue
+
+        start_at = values.get("start_at", schedule.start_at)
+        end_at = values.get("end_at", schedule.end_at)
+        if start_at and end_at and end_at < start_at:
+            errors.append("end が start より前です")
+        if errors:
+            result["errors"] = errors
+            continue
+        for column, value in values.items():
+            setattr(schedule, column, value)
+        # 日時の変更・リマインダーの再設定があれば再通知できるよう送信記録を消す
+        if kind == "update" and ("start" in data or data.get("reminder")):
+            schedule.reminded_at = None
+        if kind == "create":
+            db.session.add(schedule)
+        result["ok"] = True
+        result["schedule"] = schedule
+
+    failed = [r for r in results if not r["ok"]]
+    if failed and payload.get("atomic"):
+        db.session.rollback()
+        for r in results:
+            r.pop("schedule", None)
+        return jsonify({"results": results, "events": [], "deleted": []}), 409
+
+    db.session.flush()
+    for r in results:
+        schedule = r.pop("schedule", None)
+        if schedule is not None:
+            r["id"] = schedule.id
+            if schedule not in deleted:  # 同じ batch の中で更新後に削除したもの
+                changed[schedule.id] = schedule
+    # commit で属性が expire される前に，返すイベントとリマインダー用の値を作っておく
+    names = {}
+    company_refs = {s.company_id for s in changed.values()} - {None}
+    if company_refs:
+        names = dict(
+            db.session.execute(
+                db.select(Company.id, Company.name).where(Company.id.in_(company_refs))
+            ).all()
+        )
+    events = [_event_json(s, names.get(s.company_id)) for s in changed.values()]
+    notices = [(s.id, s.start_at, s.reminder) for s in changed.values()]
+    deleted_ids = [s.id for s in deleted]
+    db.session.commit()
+
+    scheduler = current_app.extensions.get("reminders")
+    if scheduler is not None:
+        for schedule_id, start_at, reminder in notices:
+            scheduler.notify(schedule_id, start_at, reminder)
+        for schedule_id in deleted_ids:
+            scheduler.forget(schedule_id)
+    return jsonify({"results": results, "events": events, "deleted": deleted_ids})
+
+
+# ------------------------------------------------------------------
+# カレンダー購読（iCalendar フィード・差分同期）
+# ------------------------------------------------------------------
+# 購読 URL のトークンで認証するため Basic 認証の対象外にするエンドポイント
+TOKEN_AUTH_ENDPOINTS = {"main.calendar_feed", "main.calendar_changes"}
+
+
+def _feed_user():
+    """token パラメータに対応するユーザー（なければ 404）."""
+    token = request.args.get("token", "")
+    user = User.query.filter_by(calendar_token=token).first() if token else None
+    if user is None:
+        abort(404)
+    return user
+
+
+@main_bp.route("/calendar/feed-token", methods=["POST"])
+def calendar_feed_token():
+    """購読 URL のトークンを発行する（再発行すると古い URL は使えなくなる）."""
+    g.user.calendar_token = secrets.token_urlsafe(32)
+    db.session.commit()
+    return redirect(url_for("main.calendar_view"))
+
+
+@main_bp.route("/calendar.ics")
+def calendar_feed():
+    user = _feed_user()
+    # 予定・企業名の版数から ETag を，最後に版数が進んだ日時から Last-Modified を作る
+    versions = get_version_rows(user.id, "schedules", "companies")
+    etag = f"ics-{versions['schedules'][0]}-{versions['companies'][0]}"
+    stamps = [updated_at for _version, updated_at in versions.values() if updated_at]
+    last_modified = max(stamps).replace(tzinfo=timezone.utc, microsecond=0) if stamps else None
+
+    if request.if_none_match:
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+    elif last_modified and request.if_modified_since and last_modified <= request.if_modified_since:
+        response = Response(status=304)
+        response.last_modified = last_modified
+        return response
+
+    feed = ics.calendar_feed(
+        user.id,
+        stamp=last_modified or datetime.now(timezone.utc),
+        alarm_minutes=current_app.config.get("REMINDER_LEAD_MINUTES", 60),
+    )
+    response = Response(stream_with_context(feed), mimetype="text/calendar")
+    response.headers["Content-Disposition"] = "inline; filename=calendar.ics"
+    if last_modified:
+        response.last_modified = last_modified
+    return _with_etag(response, etag)
+
+
+@main_bp.route("/api/calendar/changes")
+def calendar_changes():
+    """since（前回の sync_token）以降に変更・削除されたイベントだけを返す.
+
+    since が無い・不正・未来の値なら全件を返す（"full": true）．
+    変更がなければイベントを読まずに空のリストを返す．
+    """
+    user = _feed_user()
+    current = get_versions(user.id, "schedules")["schedules"]
+    since = request.args.get("since", "")
+    since = int(since) if since.isdigit() else 0
+    full = since <= 0 or since > current
+    result = {"sync_token": str(current), "full": full, "events": [], "deleted": []}
+    if not full and since == current:
+        return jsonify(result)
+
+    query = (
+        db.select(Schedule, Company.name)
+        .outerjoin(Company, Company.id == Schedule.company_id)
+        .where(Schedule.user_id == user.id)
+    )
+    if not full:
+        query = query.where(Schedule.sync_version > since)
+        result["deleted"] = [
+            row[0]
+            for row in db.session.execute(
+                db.select(ScheduleTombstone.schedule_id).where(
+                    ScheduleTombstone.user_id == user.id, ScheduleTombstone.version > since
+                )
+            )
+        ]
+    result["events"] = [_event_json(s, name) for s, name in db.session.execute(query)]
+    return jsonify(result)
+
+
 # ------------------------------------------------------------------
 # 就活軸管理
 # ------------------------------------------------------------------
 @main_bp.route("/axes")
 def axes_list():
-    user = User.query.first()
+    user = g.user
     axes = (
         JobAxis.query.filter_by(user_id=user.id).order_by(JobAxis.priority).all()
     )
@@ -334,7 +890,7 @@ def axes_list():
 
 @main_bp.route("/axes/new", methods=["POST"])
 def axis_new():
-    user = User.query.first()
+    user = g.user
     axis = JobAxis(
         user_id=user.id,
         name=request.form.get("name", ""),
@@ -370,38 +926,121 @@ def axis_delete(axis_id):
 # ------------------------------------------------------------------
 @main_bp.route("/api/companies")
 def api_companies():
-    user = User.query.first()
+    user = g.user
+    etag = f"companies-{get_versions(user.id, 'companies')['companies']}"
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
     companies = (
-        Company.query.filter_by(user_id=user.id).order_by(Company.name).all()
+        Company.query.filter_by(user_id=user.id)
+        .options(db.load_only(Company.id, Company.name))
+        .order_by(Company.name)
+        .all()
     )
-    return jsonify([{"id": c.id, "name": c.name} for c in companies])
+    return _with_etag(jsonify([{"id": c.id, "name": c.name} for c in companies]), etag)
 
 
 # ------------------------------------------------------------------
 # ES（エントリーシート）管理
 # ------------------------------------------------------------------
-ES_STATUSES = ["下書き", "提出済み", "合格", "不合格"]
+
+
+def _company_choices(user):
+    """ES フォームの企業の選択肢（id と名前だけ読む）."""
+    return (
+        Company.query.filter_by(user_id=user.id)
+        .options(db.load_only(Company.id, Company.name))
+        .order_by(Company.name)
+        .all()
+    )
 
 
 @main_bp.route("/es")
 def es_list():
     """ES 一覧（全企業分をまとめて表示）."""
-    user = User.query.first()
-    companies = Company.query.filter_by(user_id=user.id).order_by(Company.name).all()
-    # 締切が近い順にソート
-    all_es = (
+    user = g.user
+    status = request.args.get("status", "")
+    per_page = _page_size()
+
+    # 設問・回答の本文は読まず，設問の先頭と answer_length だけを表示する
+    query = (
         EntrySheet.query.join(Company)
         .filter(Company.user_id == user.id)
-        .order_by(EntrySheet.deadline.asc().nullslast(), EntrySheet.created_at.desc())
+        .options(
+            db.contains_eager(EntrySheet.company).load_only(Company.id, Company.name),
+            db.load_only(
+                EntrySheet.id,
+                EntrySheet.company_id,
+                EntrySheet.question_preview,
+                EntrySheet.answer_length,
+                EntrySheet.char_limit,
+                EntrySheet.deadline,
+                EntrySheet.status,
+                EntrySheet.created_at,
+            ),
+        )
+    )
+    if status:
+        query = query.filter(EntrySheet.status == status)
+    total = _count(query, EntrySheet.id)
+
+    # 締切が近い順（締切なしは最後）→ 作成が新しい順．(deadline, created_at, id) でキーセットページング
+    cursor = _decode_cursor(request.args.get("after"), 3)
+    if cursor:
+        last_deadline, last_created, last_id = cursor
+        last_created = _parse_range_bound(last_created)
+        last_deadline = _parse_date(last_deadline)
+        newer_first = db.or_(
+            EntrySheet.created_at < last_created,
+            db.and_(EntrySheet.created_at == last_created, EntrySheet.id < last_id),
+        )
+        if last_deadline is None:
+            query = query.filter(EntrySheet.deadline.is_(None), newer_first)
+        else:
+            query = query.filter(
+                db.or_(
+                    EntrySheet.deadline.is_(None),
+                    EntrySheet.deadline > last_deadline,
+                    db.and_(EntrySheet.deadline == last_deadline, newer_first),
+                )
+            )
+    rows = (
+        query.order_by(
+            EntrySheet.deadline.is_(None),
+            EntrySheet.deadline,
+            EntrySheet.created_at.desc(),
+            EntrySheet.id.desc(),
+        )
+        .limit(per_page + 1)
         .all()
     )
-    return render_template("es_list.html", entry_sheets=all_es, companies=companies, es_statuses=ES_STATUSES)
+    entry_sheets = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = entry_sheets[-1]
+        next_cursor = _encode_cursor(
+            [
+                last.deadline.isoformat() if last.deadline else None,
+                last.created_at.isoformat(),
+                last.id,
+            ]
+        )
+    return render_template(
+        "es_list.html",
+        entry_sheets=entry_sheets,
+        total=total,
+        next_cursor=next_cursor,
+        per_page=per_page,
+        es_statuses=ES_STATUSES,
+        filters={"status": status},
+    )
 
 
 @main_bp.route("/es/new", methods=["GET", "POST"])
 def es_new():
-    user = User.query.first()
-    companies = Company.query.filter_by(user_id=user.id).order_by(Company.name).all()
+    user = g.user
+    companies = _company_choices(user)
     if request.method == "POST":
         es = EntrySheet(
             company_id=int(request.form.get("company_id")),
@@ -412,6 +1051,7 @@ def es_new():
             status=request.form.get("status", "下書き"),
         )
         db.session.add(es)
+        revisions.record_revision(es)
         db.session.commit()
         return redirect(url_for("main.es_list"))
     return render_template("es_form.html", es=None, companies=companies, es_statuses=ES_STATUSES)
@@ -420,20 +1060,66 @@ def es_new():
 @main_bp.route("/es/<int:es_id>/edit", methods=["GET", "POST"])
 def es_edit(es_id):
     es = EntrySheet.query.get_or_404(es_id)
-    user = User.query.first()
-    companies = Company.query.filter_by(user_id=user.id).order_by(Company.name).all()
+    user = g.user
+    companies = _company_choices(user)
     if request.method == "POST":
         es.company_id = int(request.form.get("company_id", es.company_id))
         es.question = request.form.get("question", es.question)
+        previous = es.answer
         es.answer = request.form.get("answer", "")
         es.char_limit = int(request.form.get("char_limit") or 0) or None
         es.deadline = _parse_date(request.form.get("deadline"))
         es.status = request.form.get("status", es.status)
+        revisions.record_revision(es, previous)
         db.session.commit()
         return redirect(url_for("main.es_list"))
     return render_template("es_form.html", es=es, companies=companies, es_statuses=ES_STATUSES)
 
 
+@main_bp.route("/es/<int:es_id>/history")
+def es_history(es_id):
+    """回答の版の一覧と，選んだ版（rev）と比較する版（base，既定は 1 つ前）の差分."""
+    es = EntrySheet.query.get_or_404(es_id)
+    versions = revisions.history(es.id)
+    number = request.args.get("rev", type=int) or (versions[0].number if versions else None)
+    base_number = None
+    diff = None
+    if number is not None:
+        text = revisions.reconstruct(es.id, number)
+        if text is None:
+            abort(404)
+        base_number = request.args.get("base", number - 1, type=int)
+        base = revisions.reconstruct(es.id, base_number) if base_number else None
+        if base is None:
+            base_number = None  # 最初の版（比較する版が無い）は全文を追加として表示する
+        diff = revisions.diff_segments(base or "", text)
+    return render_template(
+        "es_history.html",
+        es=es,
+        versions=versions,
+        number=number,
+        base_number=base_number,
+        diff=diff,
+        stored_bytes=sum(v.stored_bytes for v in versions),
+        answer_bytes=len((es.answer or "").encode("utf-8")),
+        jst=timedelta(hours=9),
+    )
+
+
+@main_bp.route("/es/<int:es_id>/history/<int:number>/restore", methods=["POST"])
+def es_restore(es_id, number):
+    """過去の版の回答に戻す（戻した内容も新しい版として記録する）."""
+    es = EntrySheet.query.get_or_404(es_id)
+    text = revisions.reconstruct(es.id, number)
+    if text is None:
+        abort(404)
+    previous = es.answer
+    es.answer = text
+    revisions.record_revision(es, previous)
+    db.session.commit()
+    return redirect(url_for("main.es_edit", es_id=es.id))
+
+
 @main_bp.route("/es/<int:es_id>/delete", methods=["POST"])
 def es_delete(es_id):
     es = EntrySheet.query.get_or_404(es_id)
@@ -443,6 +1129,266 @@ def es_delete(es_id):
 
 
 
+# ------------------------------------------------------------------
+# 全文検索（ES 回答・面接ノート・企業メモ・選考の振り返り）
+# ------------------------------------------------------------------
+SEARCH_DOC_LABELS = {"es": "ES", "note": "面接ノート", "company": "企業", "selection": "選考"}
+
+
+@main_bp.route("/search")
+def search_view():
+    query = request.args.get("q", "").strip()
+    results = search(g.user.id, query) if query else []
+    return render_template(
+        "search.html", query=query, results=results, doc_labels=SEARCH_DOC_LABELS
+    )
+
+
+@main_bp.route("/api/search")
+def api_search():
+    query = request.args.get("q", "").strip()
+    return jsonify(search(g.user.id, query) if query else [])
+
+
+# ------------------------------------------------------------------
+# 一括インポート / エクスポート（CSV・JSONL）
+# ------------------------------------------------------------------
+BULK_KINDS = {"companies": "企業", "selections": "選考", "schedules": "スケジュール"}
+
+
+def _import_upload(kind):
+    """アップロードされたファイルを 1 行ずつ検証・登録し，結果の集計を返す."""
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        return {"error": "ファイルを選択してください"}
+    try:
+        fmt = bulk.detect_format(upload.filename, request.form.get("format"))
+        return bulk.import_rows(g.user.id, kind, bulk.read_rows(upload.stream, fmt))
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return {"error": "文字コードを UTF-8 にして保存し直してください（読めた行までは登録済みです）"}
+    except csv.Error as e:
+        # 不正な引用符・長すぎる項目など，行単位で飛ばせない CSV の形式エラー
+        db.session.rollback()
+        return {"error": f"CSV として読めません: {e}（読めた行までは登録済みです）"}
+    except ValueError as e:
+        return {"error": str(e)}
+
+
+@main_bp.route("/data", methods=["GET", "POST"])
+def data_transfer():
+    """一括インポート / エクスポート画面."""
+    result = kind = None
+    if request.method == "POST":
+        kind = request.form.get("kind")
+        if kind not in BULK_KINDS:
+            abort(400)
+        result = _import_upload(kind)
+    return render_template(
+        "data_transfer.html",
+        kinds=BULK_KINDS,
+        kind=kind,
+        result=result,
+        reports=REPORT_KINDS,
+        report_font_error=current_app.extensions["reports"].font_error(),
+    )
+
+
+@main_bp.route("/api/import/<kind>", methods=["POST"])
+def api_import(kind):
+    if kind not in BULK_KINDS:
+        abort(404)
+    result = _import_upload(kind)
+    return jsonify(result), 400 if "error" in result else 200
+
+
+@main_bp.route("/export/<kind>.<fmt>")
+def data_export(kind, fmt):
+    """1 行ずつ生成してストリーミングで返す（全件をメモリに載せない）."""
+    if kind not in BULK_KINDS or fmt not in bulk.FORMATS:
+        abort(404)
+    rows = bulk.export_rows(g.user.id, kind, fmt)
+    response = Response(stream_with_context(rows), mimetype=bulk.MIMETYPES[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename={kind}.{fmt}"
+    return response
+
+
+# ------------------------------------------------------------------
+# 選考ファネルの分析（SQL で集計し，選考・ES の書き込みまでキャッシュ）
+# ------------------------------------------------------------------
+@main_bp.route("/analytics")
+def analytics_view():
+    report = analytics.selection_funnel(g.user.id)
+    return render_template(
+        "analytics.html",
+        sections=analytics.report_sections(report),
+        reports=REPORT_KINDS,
+        report_font_error=current_app.extensions["reports"].font_error(),
+    )
+
+
+@main_bp.route("/api/analytics")
+def api_analytics():
+    tag = analytics.version_tag(g.user.id)
+    not_modified = _not_modified(tag)
+    if not_modified:
+        return not_modified
+    return _with_etag(jsonify(analytics.selection_funnel(g.user.id, tag)), tag)
+
+
+@main_bp.route("/analytics.csv")
+def analytics_export():
+    report = analytics.selection_funnel(g.user.id)
+    response = Response(analytics.report_csv(report), mimetype=bulk.MIMETYPES["csv"])
+    response.headers["Content-Disposition"] = "attachment; filename=analytics.csv"
+    return response
+
+
+# ------------------------------------------------------------------
+# PDF レポート（バックグラウンドで生成し，job id で状態を問い合わせる）
+# ------------------------------------------------------------------
+@main_bp.route("/reports/<kind>", methods=["POST"])
+def report_create(kind):
+    if kind not in REPORT_KINDS:
+        abort(404)
+    runner = current_app.extensions["reports"]
+    # フォントが無いと必ず失敗するため，ジョブを受け付けずに理由を返す
+    font_error = runner.font_error()
+    if font_error:
+        return jsonify({"error": font_error}), 503
+    job_id = runner.submit(g.user.id, kind)
+    status_url = url_for("main.report_status", job_id=job_id)
+    return jsonify({"job_id": job_id, "status_url": status_url}), 202, {"Location": status_url}
+
+
+@main_bp.route("/reports/jobs/<job_id>")
+def report_status(job_id):
+    status = current_app.extensions["reports"].status(job_id, g.user.id)
+    if status is None:
+        abort(404)
+    if status["status"] == "done":
+        status["download_url"] = url_for("main.report_download", job_id=job_id)
+    return jsonify(status)
+
+
+@main_bp.route("/reports/jobs/<job_id>.pdf")
+def report_download(job_id):
+    path = current_app.extensions["reports"].pdf_path(job_id, g.user.id)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype="application/pdf", as_attachment=True, download_name="report.pdf")
+
+
+# ------------------------------------------------------------------
+# CLI コマンド（flask --app app <command>）
+# ------------------------------------------------------------------
+@main_bp.cli.command("init-db")
+def init_db_command():
+    """テーブル作成・不足している列やインデックスの追加・初期データの投入を行う（何度実行してもよい）."""
+    added = init_database()
+    if "companies.current_stage" in added:
+        _clear_page_cache(current_app)
+    for name in added:
+        print(f"  追加: {name}")
+    print(f"データベースを初期化しました（列・インデックスの追加 {len(added)} 件）")
+
+
+# 以前のコマンド名
+main_bp.cli.add_command(init_db_command, "upgrade-db")
+
+
+@main_bp.cli.command("backfill-current-stage")
+def backfill_current_stage_command():
+    """企業の current_stage / current_status を選考テーブルから再計算する."""
+    count = backfill_current_selection()
+    _clear_page_cache(current_app)
+    print(f"{count} 社の選考段階を更新しました")
+
+
+@main_bp.cli.command("reindex-search")
+def reindex_search_command():
+    """全文検索の文書を元データから作り直す."""
+    init_search()
+    count = rebuild_search_index()
+    print(f"{count} 件の文書を検索インデックスに登録しました")
+
+
+@main_bp.cli.command("import-data")
+@click.argument("kind", type=click.Choice(list(BULK_KINDS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(bulk.FORMATS), help="省略時は拡張子から判定")
+def import_data_command(kind, path, fmt):
+    """CSV / JSONL ファイルから企業・選考・スケジュールを一括登録する."""
+    user = User.query.order_by(User.id).first()
+    with open(path, "rb") as f:
+        result = bulk.import_rows(user.id, kind, bulk.read_rows(f, bulk.detect_format(path, fmt)))
+    for item in result["errors"]:
+        print(f"  {item['line']} 行目: {' / '.join(item['errors'])}")
+    print(f"{result['inserted']} 件を登録しました（エラー {result['failed']} 件）")
+
+
+@main_bp.cli.command("export-data")
+@click.argument("kind", type=click.Choice(list(BULK_KINDS)))
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--format", "fmt", type=click.Choice(bulk.FORMATS), help="省略時は拡張子から判定")
+def export_data_command(kind, path, fmt):
+    """企業・選考・スケジュールを CSV / JSONL ファイルに書き出す."""
+    user = User.query.order_by(User.id).first()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for chunk in bulk.export_rows(user.id, kind, bulk.detect_format(path, fmt)):
+            f.write(chunk)
+    print(f"{path} に書き出しました")
+
+
+@main_bp.cli.command("reencrypt-passwords")
+@click.option("--chunk-size", default=500, show_default=True, help="1 回に読み書きする行数")
+def reencrypt_passwords_command(chunk_size):
+    """マイページのパスワードを現在の SECRET_KEY で暗号化し直す（鍵のローテーション用）."""
+    count = reencrypt_column(db.session, Company.__table__.c.mypage_password, chunk_size)
+    print(f"{count} 件のパスワードを暗号化し直しました")
+
+
+# ------------------------------------------------------------------
+# ヘルパー（ページング）
+# ------------------------------------------------------------------
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+
+
+def _page_size():
+    """per_page パラメータを 1〜PAGE_SIZE_MAX に収めて返す."""
+    try:
+        size = int(request.args.get("per_page", PAGE_SIZE_DEFAULT))
+    except ValueError:
+        return PAGE_SIZE_DEFAULT
+    return min(max(size, 1), PAGE_SIZE_MAX)
+
+
+def _encode_cursor(values):
+    """キーセットページングの位置（最後の行のソートキー）を URL 用の文字列にする."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(token, size):
+    """_encode_cursor の逆変換．不正な値なら None（先頭ページ扱い）."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def _count(query, column):
+    """並び順を外した COUNT(*) で絞り込み後の総件数を返す."""
+    return query.order_by(None).with_entities(db.func.count(column)).scalar()
+
+
 # ------------------------------------------------------------------
 # ヘルパー（日付パース）
 # ------------------------------------------------------------------
@@ -459,6 +1405,43 @@ def _parse_date(value):
 # ==================================================================
 # アプリケーションファクトリ
 # ==================================================================
+def _clear_page_cache(app):
+    """ORM を通さない一括更新の後にページキャッシュを捨てる（世代では検知できないため）."""
+    cache = app.extensions.get("page_cache")
+    if cache is not None:
+        cache.clear()
+
+
+def _refuse_until_initialized(app):
+    """スキーマが古い間は 503 を返す（init-db の実行後は次のリクエストから通常どおり）."""
+    app.logger.error("データベースが未初期化か古い版です。flask --app app init-db を実行してください")
+    state = {"current": False}
+
+    @app.before_request
+    def require_current_schema():
+        if state["current"]:
+            return None
+        state["current"] = schema_is_current()
+        if state["current"]:
+            return None
+        return Response(
+            "データベースの初期化が必要です（flask --app app init-db）。",
+            503,
+            {"Retry-After": "30"},
+        )
+
+
+def _configure_sqlite(engine, pragmas):
+    """SQLite の接続ごとに PRAGMA（WAL・synchronous・busy_timeout）を設定する."""
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
 def create_app():
     """Flask アプリケーションファクトリ."""
     import sys
@@ -475,6 +1458,23 @@ def create_app():
     # Blueprint をアプリに登録
     app.register_blueprint(main_bp)
 
+    # SQL 件数・処理時間の計測（INSTRUMENTATION=1 のときのみ）
+    if app.config["INSTRUMENTATION_ENABLED"]:
+        init_instrumentation(app)
+
+    # 描画済みページのキャッシュ（PAGE_CACHE=memory / filesystem のときのみ）
+    init_page_cache(app)
+
+    # ハッシュ付きの静的ファイル（python assets.py でビルドした場合のみ）
+    init_assets(app)
+
+    # PDF レポートのバックグラウンド生成
+    init_reports(app)
+
+    # スケジュールのリマインダー通知（REMINDERS=1 のときのみ）
+    if app.config["REMINDERS_ENABLED"]:
+        init_reminders(app)
+
     # ----------------------------------------------------------
     # Basic 認証（環境変数で有効化、ローカル開発時は無効）
     # ----------------------------------------------------------
@@ -485,6 +1485,9 @@ def create_app():
 
         @app.before_request
         def require_basic_auth():
+            # カレンダー購読は URL のトークンで認証する（購読アプリは Basic 認証を送れない）
+            if request.endpoint in TOKEN_AUTH_ENDPOINTS:
+                return None
             auth = request.authorization
             if (
                 not auth
@@ -498,11 +1501,15 @@ def create_app():
                 )
 
     with app.app_context():
-        db.create_all()
-        if not User.query.first():
-            default_user = User(name="ユーザー")
-            db.session.add(default_user)
-            db.session.commit()
+        if db.engine.dialect.name == "sqlite":
+            _configure_sqlite(db.engine, app.config["SQLITE_PRAGMAS"])
+        # 起動時は schema_version を 1 回読むだけ（作成・追従は init-db コマンドで行う）
+        if not schema_is_current():
+            if app.config["DB_AUTO_INIT"]:
+                if "companies.current_stage" in init_database():
+                    _clear_page_cache(app)
+            else:
+                _refuse_until_initialized(app)
 
     return app
 # ==================================================================
@@ -0,0 +1,273 @@
+"""就活管理アプリ — 静的ファイルのビルド（ハッシュ付きファイル名・事前圧縮・WOFF2）.
+
+ビルド（`python assets.py`，デプロイ時に 1 回）:
+
+* static/ 以下のファイルを内容のハッシュ付きの名前で static/dist/ に書き出す
+  （例: style.css → dist/style.3f9a0c1d2e.css）
+* フォントは WOFF2 に変換する．FONT_SUBSETS に一致するもの（Inter）は Latin の範囲に絞る
+* CSS 内の url(...) はハッシュ付きの名前に書き換える
+* テキスト（CSS・JS など）は gzip / brotli で圧縮したファイル（.gz / .br）も書き出す
+* 対応表を static/dist/manifest.json に保存する
+
+実行時（init_assets）:
+
+* url_for("static", filename=...) が対応表のハッシュ付きの名前を返す（テンプレートは変更不要）
+* dist/ 以下は Cache-Control: immutable（1 年）で返し，Accept-Encoding に応じて
+  .br / .gz をそのまま送る（リクエストごとに圧縮しない）
+* 対応表が無い（ビルドしていない）場合や，ビルド後に元ファイルを変えた場合は元ファイルを返す
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import sys
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, "static")
+DIST = "dist"
+MANIFEST = "manifest.json"
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# 事前圧縮する拡張子（フォント・画像は圧縮済みのため対象外）
+COMPRESSIBLE = {".css", ".js", ".json", ".svg", ".txt", ".html"}
+FONT_EXTENSIONS = {".ttf", ".otf"}
+# ファイル名の接頭辞 → サブセットに残す文字の範囲（日本語は Noto Sans JP が表示する）
+LATIN = "U+0000-00FF,U+0131,U+0152-0153,U+02BB-02BC,U+02C6,U+02DA,U+02DC,U+2000-206F,U+2074,U+20AC,U+2122,U+2191,U+2193,U+2212,U+2215,U+FEFF,U+FFFD"
+FONT_SUBSETS = {"Inter-": LATIN}
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+_FONT_FORMAT = re.compile(r"""format\(\s*['"](?:truetype|opentype)['"]\s*\)""")
+
+
+# ------------------------------------------------------------------
+# ビルド
+# ------------------------------------------------------------------
+def _hashed_name(path, data):
+    stem, ext = posixpath.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _unicodes(ranges):
+    codepoints = []
+    for part in ranges.split(","):
+        start, _, end = part.strip()[2:].partition("-")
+        codepoints.extend(range(int(start, 16), int(end or start, 16) + 1))
+    return codepoints
+
+
+def _woff2(source):
+    """フォントを WOFF2 にする（FONT_SUBSETS に一致すれば文字を絞る）."""
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    font = TTFont(source)
+    ranges = next(
+        (r for prefix, r in FONT_SUBSETS.items() if os.path.basename(source).startswith(prefix)),
+        None,
+    )
+    if ranges:
+        options = subset.Options()
+        options.layout_features = ["*"]
+        options.name_IDs = ["*"]
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=_unicodes(ranges))
+        subsetter.subset(font)
+    font.flavor = "woff2"
+    buffer = io.BytesIO()
+    font.save(buffer)
+    return buffer.getvalue()
+
+
+def _rewrite_css(data, css_path, out_path, files):
+    """CSS の url(...) を書き出し先（dist/）から見たハッシュ付きのパスに書き換える."""
+    css_dir = posixpath.dirname(css_path)
+    out_dir = posixpath.dirname(out_path)
+
+    def replace(match):
+        quote, ref = match.groups()
+        if re.match(r"^(?:[a-z]+:|/|#)", ref):
+            return match.group(0)  # data: / 絶対 URL はそのまま
+        logical = posixpath.normpath(posixpath.join(css_dir, ref))
+        target = files.get(logical, {}).get("path", logical)
+        return f"url({quote}{posixpath.relpath(target, out_dir)}{quote})"
+
+    text = _CSS_URL.sub(replace, data.decode("utf-8"))
+    # WOFF2 に変換したフォントの format() を合わせる
+    text = re.sub(
+        r"(url\([^)]*\.woff2['\"]?\)\s*)" + _FONT_FORMAT.pattern, r"\1format('woff2')", text
+    )
+    return text.encode("utf-8")
+
+
+def _compress(data):
+    """{拡張子: 圧縮後のデータ}（元より小さくならないものは含めない）."""
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        logger.warning("brotli が無いため .br は作成しません（pip install Brotli）")
+    else:
+        variants[".br"] = brotli.compress(data, quality=11)
+    return {ext: body for ext, body in variants.items() if len(body) < len(data)}
+
+
+def _walk(directory, skip=None):
+    """directory 以下のファイルの相対パス（"/" 区切り）．skip のサブディレクトリは除く."""
+    for root, dirs, names in os.walk(directory):
+        rel_root = os.path.relpath(root, directory).replace(os.sep, "/")
+        if rel_root == skip:
+            dirs[:] = []
+            continue
+        for name in sorted(names):
+            yield posixpath.normpath(posixpath.join(rel_root, name))
+
+
+def _built_files(static_dir, files=None):
+    """対応表に載っているファイル（dist/ からの相対パス．圧縮版を含む）."""
+    if files is None:
+        try:
+            with open(os.path.join(static_dir, DIST, MANIFEST), encoding="utf-8") as f:
+                files = json.load(f)
+        except (OSError, ValueError):
+            return set()
+    paths = set()
+    for entry in files.values():
+        path = posixpath.relpath(entry["path"], DIST)
+        paths.add(path)
+        paths.update(path + suffix for enc, suffix in ENCODINGS if enc in entry["encodings"])
+    return paths
+
+
+def build_assets(static_dir=STATIC_DIR):
+    """static/ のファイルを dist/ に書き出し，対応表を返す."""
+    dist_dir = os.path.join(static_dir, DIST)
+    os.makedirs(dist_dir, exist_ok=True)
+    previous = _built_files(static_dir)
+    sources = list(_walk(static_dir, skip=DIST))
+    # CSS から参照されるフォント・画像のハッシュ名を先に決める
+    sources.sort(key=lambda p: posixpath.splitext(p)[1] == ".css")
+    files = {}
+    written = {MANIFEST}
+    for path in sources:
+        source = os.path.join(static_dir, path)
+        ext = posixpath.splitext(path)[1]
+        if ext in FONT_EXTENSIONS:
+            data = _woff2(source)
+            out_path = _hashed_name(posixpath.splitext(path)[0] + ".woff2", data)
+        else:
+            with open(source, "rb") as f:
+                data = f.read()
+            if ext == ".css":
+                # ハッシュは書き換え後の内容で決める（参照先が変われば名前も変わる）
+                placeholder = posixpath.join(DIST, path)
+                data = _rewrite_css(data, path, placeholder, files)
+            out_path = _hashed_name(path, data)
+        variants = _compress(data) if ext in COMPRESSIBLE else {}
+        for suffix, body in [("", data), *variants.items()]:
+            target = os.path.join(dist_dir, out_path + suffix)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(body)
+            written.add(out_path + suffix)
+        stat = os.stat(source)
+        files[path] = {
+            "path": posixpath.join(DIST, out_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "encodings": [enc for enc, suffix in ENCODINGS if suffix in variants],
+        }
+
+    with open(os.path.join(dist_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(files, f, ensure_ascii=False, indent=2)
+    # 前々回以前のビルドのファイルを消す（前回の分は，デプロイ前に描画されたページ・
+    # キャッシュ済みのページが参照しているため残す）
+    keep = written | previous
+    for path in _walk(dist_dir):
+        if path not in keep:
+            os.remove(os.path.join(dist_dir, path))
+    return files
+
+
+# ------------------------------------------------------------------
+# 実行時
+# ------------------------------------------------------------------
+def load_manifest(static_dir):
+    """対応表を読み，ビルド後に変更された元ファイルの項目を除いて返す."""
+    try:
+        with open(os.path.join(static_dir, DIST, MANIFEST), encoding="utf-8") as f:
+            files = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    current = {}
+    for path, entry in files.items():
+        try:
+            stat = os.stat(os.path.join(static_dir, path))
+        except OSError:
+            continue
+        if (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+            logger.warning("%s はビルド後に変更されています（python assets.py で再ビルド）", path)
+            continue
+        current[path] = entry
+    return current
+
+
+def init_assets(app):
+    """url_for("static") をハッシュ付きの名前にし，dist/ の配信を差し替える."""
+    from flask import request, send_from_directory
+
+    files = load_manifest(app.static_folder)
+    if not files:
+        return None
+    hashed = {entry["path"]: entry["encodings"] for entry in files.values()}
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == "static" and values.get("filename") in files:
+            values["filename"] = files[values["filename"]]["path"]
+
+    serve_original = app.view_functions["static"]
+
+    def static(filename):
+        encodings = hashed.get(filename)
+        if encodings is None:
+            return serve_original(filename=filename)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings and encoding in request.accept_encodings:
+                response = send_from_directory(
+                    app.static_folder,
+                    filename + suffix,
+                    mimetype=mimetype,
+                    max_age=IMMUTABLE_MAX_AGE,
+                )
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(
+                app.static_folder, filename, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE
+            )
+        if encodings:
+            response.vary.add("Accept-Encoding")
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions["static"] = static
+    return files
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("fontTools").setLevel(logging.WARNING)
+    built = build_assets(sys.argv[1] if len(sys.argv) > 1 else STATIC_DIR)
+    for path, entry in built.items():
+        encodings = "・".join(entry["encodings"]) or "圧縮なし"
+        print(f"  {path} → {entry['path']}（{encodings}）")
+    print(f"{len(built)} 件のファイルを書き出しました")
@@ -0,0 +1,410 @@
+"""就活管理アプリ — ルート単位のベンチマーク.
+
+合成データを投入した SQLite DB に対して main_bp の GET ルートを
+Flask テストクライアントで繰り返し叩き，レイテンシのパーセンタイル・
+スループット・SQL 件数を JSON で出力する．--compare で保存済みの
+ベースラインと比較し，劣化があれば終了コード 1 を返す．
+QUERY_BUDGETS の SQL 件数を超えたルートがあっても終了コード 1 を返す．
+--cold-start-runs で，新しいプロセスでの app の import（create_app を含む）と
+create_app の所要時間・起動時の SQL 件数も計測する．
+
+使い方:
+    python benchmark.py --output bench_baseline.json
+    python benchmark.py --compare bench_baseline.json
+    python benchmark.py --companies 200 --schedules 5000 --iterations 50
+    python benchmark.py --cold-start-runs 10
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# 既定の投入件数（1ユーザーで数シーズン分の就活を想定）
+DEFAULT_VOLUMES = {
+    "companies": 1000,
+    "selections": 10000,
+    "entry_sheets": 5000,
+    "schedules": 20000,
+}
+
+# ルートごとの SQL 件数の上限（件数に比例して増えたら N+1 の再発）．
+# 既定の設定（USER_CACHE_TTL=0）で計測するため，各ルートの現在のユーザーの読み込み 1 件を含む
+QUERY_BUDGETS = {
+    "main.dashboard": 5,
+    "main.company_list": 5,
+    "main.es_list": 4,
+    "main.api_events": 4,
+    "main.api_companies": 4,
+}
+
+# カレンダー購読 URL のトークン（合成データのユーザーに設定する）
+BENCH_FEED_TOKEN = "bench"
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ルート単位のベンチマーク")
+    for name, default in DEFAULT_VOLUMES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    parser.add_argument("--iterations", type=int, default=20, help="ルートごとの計測回数")
+    parser.add_argument("--seed", type=int, default=42, help="合成データの乱数シード")
+    parser.add_argument("--db", help="使用する SQLite ファイル（既定は一時ファイル）")
+    parser.add_argument("--output", help="レポートの出力先（既定は標準出力）")
+    parser.add_argument("--compare", help="比較するベースラインのレポート")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="p95 の許容劣化率（0.25 = 25%%）"
+    )
+    parser.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=2.0,
+        help="劣化とみなす p95 の最小増加量（ミリ秒．計測ノイズ対策）",
+    )
+    parser.add_argument(
+        "--cold-start-runs", type=int, default=5, help="起動時間の計測回数（0 で計測しない）"
+    )
+    return parser.parse_args(argv)
+
+
+# ------------------------------------------------------------------
+# 合成データ
+# ------------------------------------------------------------------
+def seed_database(volumes, rng):
+    """models.py のモデルで合成データを一括投入する（アプリコンテキスト内で呼ぶ）."""
+    from models import (
+        EVENT_TYPES,
+        SELECTION_STAGES,
+        SELECTION_STATUSES,
+        Company,
+        EntrySheet,
+        JobAxis,
+        Schedule,
+        Selection,
+        User,
+        db,
+    )
+    from schema import backfill_current_selection
+    from search import rebuild_search_index
+
+    user = User.query.order_by(User.id).first()
+    user.calendar_token = BENCH_FEED_TOKEN
+    industries = ["IT", "メーカー", "商社", "金融", "コンサル", "インフラ"]
+    base = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    db.session.execute(
+        db.insert(Company),
+        [
+            {
+                "user_id": user.id,
+                "name": f"企業{i:05d}",
+                "industry": rng.choice(industries),
+                "job_type": "総合職",
+                "description": "事業内容" * 20,
+                "preference": rng.randint(1, 5),
+                "notes": "メモ" * 50,
+            }
+            for i in range(volumes["companies"])
+        ],
+    )
+    company_ids = [row[0] for row in db.session.execute(db.select(Company.id))]
+
+    db.session.execute(
+        db.insert(Selection),
+        [
+            {
+                "company_id": rng.choice(company_ids),
+                "stage": rng.choice(SELECTION_STAGES),
+                "status": rng.choice(SELECTION_STATUSES),
+                "scheduled_at": base + timedelta(days=rng.randint(-120, 60)),
+                "location": "オンライン",
+                "feedback": "振り返り" * 10,
+            }
+            for _ in range(volumes["selections"])
+        ],
+    )
+    db.session.execute(
+        db.insert(EntrySheet),
+        [
+            {
+                "company_id": rng.choice(company_ids),
+                "question": "学生時代に最も力を入れたことは何ですか？" * 2,
+                "answer": "回答" * rng.randint(50, 300),
+                "char_limit": rng.choice([None, 200, 400, 600]),
+                "deadline": date.today() + timedelta(days=rng.randint(-60, 60)),
+                "status": rng.choice(["下書き", "提出済み", "合格", "不合格"]),
+            }
+            for _ in range(volumes["entry_sheets"])
+        ],
+    )
+    db.session.execute(
+        db.insert(Schedule),
+        [
+            {
+                "user_id": user.id,
+                "company_id": rng.choice(company_ids + [None]),
+                "event_type": rng.choice(EVENT_TYPES),
+                "title": f"イベント{i}",
+                "start_at": base + timedelta(hours=rng.randint(-24 * 365, 24 * 90)),
+                "location_or_url": "https://example.com",
+            }
+            for i in range(volumes["schedules"])
+        ],
+    )
+    db.session.execute(
+        db.insert(JobAxis),
+        [
+            {"user_id": user.id, "name": f"軸{i}", "description": "説明", "priority": i}
+            for i in range(1, 6)
+        ],
+    )
+    db.session.commit()
+    # 一括 INSERT は ORM の flush を通らないため，派生データはまとめて作り直す
+    backfill_current_selection()
+    rebuild_search_index()
+
+
+# ------------------------------------------------------------------
+# 計測
+# ------------------------------------------------------------------
+def _route_targets(app):
+    """main_bp の GET ルートを (endpoint, path) のリストで返す．
+
+    URL 変数は投入済みデータの id で埋め，/api/events には FullCalendar と同じ
+    表示期間（今月）を付ける．埋められない変数を持つルートは対象外．
+    """
+    from models import Company, EntrySheet, db
+
+    with app.app_context():
+        sample_ids = {
+            "company_id": db.session.execute(db.select(db.func.min(Company.id))).scalar(),
+            "es_id": db.session.execute(db.select(db.func.min(EntrySheet.id))).scalar(),
+        }
+
+    month_start = date.today().replace(day=1)
+    window_end = month_start + timedelta(days=42)
+    extra_query = {
+        "main.api_events": (
+            f"start={month_start.isoformat()}T00:00:00%2B09:00"
+            f"&end={window_end.isoformat()}T00:00:00%2B09:00"
+        ),
+        "main.search_view": "q=力を入れた",
+        "main.calendar_feed": f"token={BENCH_FEED_TOKEN}",
+        "main.calendar_changes": f"token={BENCH_FEED_TOKEN}&since=1",
+        "main.api_search": "q=回答+学生",
+    }
+
+    targets = []
+    with app.test_request_context():
+        from flask import url_for
+
+        for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+            if not rule.endpoint.startswith("main.") or "GET" not in rule.methods:
+                continue
+            if any(arg not in sample_ids for arg in rule.arguments):
+                continue
+            path = url_for(rule.endpoint, **{arg: sample_ids[arg] for arg in rule.arguments})
+            if rule.endpoint in extra_query:
+                path = f"{path}?{extra_query[rule.endpoint]}"
+            targets.append((rule.endpoint, path))
+    return targets
+
+
+def measure(app, iterations):
+    """各ルートを計測し {endpoint: 結果} を返す."""
+    from sqlalchemy import event
+
+    from instrumentation import percentile
+    from models import db
+
+    with app.app_context():
+        engine = db.engine
+    counter = {"queries": 0}
+
+    def count_query(*_args):
+        counter["queries"] += 1
+
+    event.listen(engine, "before_cursor_execute", count_query)
+    client = app.test_client()
+    results = {}
+    try:
+        for endpoint, path in _route_targets(app):
+            client.get(path).get_data()  # ウォームアップ（テンプレートのコンパイル等）
+            timings = []
+            queries = []
+            for _ in range(iterations):
+                counter["queries"] = 0
+                started = time.perf_counter()
+                response = client.get(path)
+                # ストリーミングのレスポンスは本文を読み切るまでを計測に含める
+                body = response.get_data()
+                timings.append((time.perf_counter() - started) * 1000)
+                queries.append(counter["queries"])
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{path} が {response.status_code} を返しました")
+            timings.sort()
+            results[endpoint] = {
+                "path": path,
+                "iterations": iterations,
+                "bytes": len(body),
+                "mean_ms": round(sum(timings) / len(timings), 3),
+                "p50_ms": round(percentile(timings, 50), 3),
+                "p95_ms": round(percentile(timings, 95), 3),
+                "p99_ms": round(percentile(timings, 99), 3),
+                "rps": round(1000 * len(timings) / sum(timings), 1),
+                "queries": max(queries),
+            }
+    finally:
+        event.remove(engine, "before_cursor_execute", count_query)
+    return results
+
+
+def check_query_budgets(report):
+    """QUERY_BUDGETS を超えたルートを表示し，そのルート名のリストを返す."""
+    over = []
+    for endpoint, budget in QUERY_BUDGETS.items():
+        result = report["routes"].get(endpoint)
+        if result and result["queries"] > budget:
+            print(
+                f"{endpoint}: SQL {result['queries']} 件（上限 {budget} 件）",
+                file=sys.stderr,
+            )
+            over.append(endpoint)
+    return over
+
+
+def compare(report, baseline, tolerance, min_delta_ms):
+    """ベースラインとの差分を表示し，劣化したルート名のリストを返す."""
+    regressions = []
+    print(f"{'endpoint':32} {'p95 base':>10} {'p95 now':>10} {'Δ%':>8} {'queries':>12}", file=sys.stderr)
+    for endpoint, now in report["routes"].items():
+        base = baseline.get("routes", {}).get(endpoint)
+        if base is None:
+            print(f"{endpoint:32} {'—':>10} {now['p95_ms']:>10.2f} {'new':>8}", file=sys.stderr)
+            continue
+        delta = (now["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        queries = f"{base['queries']}→{now['queries']}"
+        slower = delta > tolerance and now["p95_ms"] - base["p95_ms"] > min_delta_ms
+        more_queries = now["queries"] > base["queries"]
+        mark = " ✗" if slower or more_queries else ""
+        print(
+            f"{endpoint:32} {base['p95_ms']:>10.2f} {now['p95_ms']:>10.2f} "
+            f"{delta * 100:>7.1f}% {queries:>12}{mark}",
+            file=sys.stderr,
+        )
+        if slower or more_queries:
+            regressions.append(endpoint)
+    return regressions
+
+
+# ------------------------------------------------------------------
+# 起動時間（コールドスタート）
+# ------------------------------------------------------------------
+# 新しいプロセスで実行する計測スクリプト（import app が gunicorn のワーカー起動に相当）
+_COLD_START_SCRIPT = """
+import json, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+queries = []
+event.listen(Engine, "before_cursor_execute", lambda *a, **k: queries.append(a[2]))
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+startup_queries = len(queries)
+app.create_app()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (time.perf_counter() - imported) * 1000,
+    "queries": startup_queries,
+}))
+"""
+
+
+def measure_cold_start(runs):
+    """新しいプロセスで app を import し，起動にかかる時間と SQL 件数を計測する.
+
+    import_ms はモジュールの読み込みと create_app の合計（ワーカーの起動に相当），
+    create_app_ms は読み込み済みのプロセスでもう一度 create_app を呼んだ時間．
+    DATABASE_URL は呼び出し側で設定済みの DB（初期化済み）を使う．
+    """
+    from instrumentation import percentile
+
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _COLD_START_SCRIPT],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    result = {"runs": runs, "queries": max(s["queries"] for s in samples)}
+    for key in ("import_ms", "create_app_ms"):
+        values = sorted(s[key] for s in samples)
+        result[key] = {
+            "p50": round(percentile(values, 50), 1),
+            "max": round(values[-1], 1),
+        }
+    return result
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    volumes = {name: getattr(args, name) for name in DEFAULT_VOLUMES}
+
+    # config.py は import 時に DATABASE_URL を読むため，app の import 前に設定する
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="syukatsu-bench-"), "bench.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from app import app
+
+    started = time.perf_counter()
+    with app.app_context():
+        seed_database(volumes, random.Random(args.seed))
+    seed_seconds = time.perf_counter() - started
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "database": "sqlite",
+            "volumes": volumes,
+            "iterations": args.iterations,
+            "seed_seconds": round(seed_seconds, 2),
+        },
+        "routes": measure(app, args.iterations),
+    }
+    if args.cold_start_runs > 0:
+        report["cold_start"] = measure_cold_start(args.cold_start_runs)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if check_query_budgets(report):
+        print("SQL 件数の上限を超えたルートがあります", file=sys.stderr)
+        return 1
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"劣化を検出しました: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
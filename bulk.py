@@ -0,0 +1,381 @@
+"""就活管理アプリ — 企業・選考・スケジュールの一括インポート / エクスポート.
+
+CSV（UTF-8，BOM 付きも可）と JSONL（1 行 1 オブジェクト）に対応する．
+
+* インポートはアップロードを 1 行ずつ読み，フォームと同じ規則で検証して
+  IMPORT_BATCH_SIZE 行ごとに 1 トランザクションで登録する．
+  不正な行は登録せず，行番号とエラー内容を返す
+* エクスポートは yield_per で少しずつ読み，1 行ずつ文字列を返すジェネレータ．
+  大量のデータでもメモリ使用量が件数に比例しない
+
+選考・スケジュールの企業は company_id か company_name（同名が複数あれば
+志望度の高い方）で指定する．エクスポートは両方を出力するため，
+そのままインポートし直せる．
+"""
+
+import codecs
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import current_app
+
+from models import (
+    EVENT_TYPES,
+    SELECTION_STAGES,
+    SELECTION_STATUSES,
+    Company,
+    Schedule,
+    Selection,
+    db,
+)
+from schema import backfill_current_selection
+
+FORMATS = ("csv", "jsonl")
+MIMETYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+# 種別ごとの列（エクスポートの列順・CSV のヘッダ）
+FIELDS = {
+    "companies": [
+        "id",
+        "name",
+        "industry",
+        "job_type",
+        "description",
+        "preference",
+        "mypage_url",
+        "mypage_id",
+        "notes",
+    ],
+    "selections": [
+        "id",
+        "company_id",
+        "company_name",
+        "stage",
+        "status",
+        "scheduled_at",
+        "location",
+        "feedback",
+    ],
+    "schedules": [
+        "id",
+        "company_id",
+        "company_name",
+        "event_type",
+        "title",
+        "start",
+        "end",
+        "location_or_url",
+        "reminder",
+    ],
+}
+
+EXPORT_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+
+
+# ------------------------------------------------------------------
+# 値の変換
+# ------------------------------------------------------------------
+def _text(row, key):
+    value = row.get(key)
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def _parse_datetime(value):
+    """ISO 8601（日付のみ・秒なしも可）を naive な datetime に変換．不正なら ValueError."""
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "on", "○")
+
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="minutes")
+    return value
+
+
+# ------------------------------------------------------------------
+# 行の検証（フォームと同じ規則）
+# ------------------------------------------------------------------
+def _resolve_company(row, companies, errors):
+    """company_id / company_name から企業 id を求める（見つからなければ errors に追加）."""
+    company_id = _text(row, "company_id")
+    if company_id:
+        if not company_id.isdigit() or int(company_id) not in companies["ids"]:
+            errors.append(f"company_id {company_id} の企業がありません")
+            return None
+        return int(company_id)
+    name = _text(row, "company_name")
+    if not name:
+        errors.append("company_id か company_name が必要です")
+        return None
+    if name not in companies["names"]:
+        errors.append(f"企業「{name}」がありません")
+        return None
+    return companies["names"][name]
+
+
+def _validate_company(row, user_id, _companies):
+    errors = []
+    name = _text(row, "name")
+    if not name:
+        errors.append("name（企業名）は必須です")
+    preference = _text(row, "preference") or "3"
+    if not preference.isdigit() or not 1 <= int(preference) <= 5:
+        errors.append("preference（志望度）は 1〜5 の整数です")
+    if errors:
+        return None, errors
+    return Company(
+        user_id=user_id,
+        name=name,
+        industry=_text(row, "industry"),
+        job_type=_text(row, "job_type"),
+        description=_text(row, "description"),
+        preference=int(preference),
+        mypage_url=_text(row, "mypage_url"),
+        mypage_id=_text(row, "mypage_id"),
+        notes=_text(row, "notes"),
+    ), []
+
+
+def _validate_selection(row, _user_id, companies):
+    errors = []
+    company_id = _resolve_company(row, companies, errors)
+    stage = _text(row, "stage") or "エントリー"
+    if stage not in SELECTION_STAGES:
+        errors.append(f"stage「{stage}」は選考段階の一覧にありません")
+    status = _text(row, "status") or "予定"
+    if status not in SELECTION_STATUSES:
+        errors.append(f"status「{status}」はステータスの一覧にありません")
+    scheduled_at = None
+    if _text(row, "scheduled_at"):
+        try:
+            scheduled_at = _parse_datetime(_text(row, "scheduled_at"))
+        except ValueError:
+            errors.append("scheduled_at の日時が不正です")
+    if errors:
+        return None, errors
+    return Selection(
+        company_id=company_id,
+        stage=stage,
+        status=status,
+        scheduled_at=scheduled_at,
+        location=_text(row, "location"),
+        feedback=_text(row, "feedback"),
+    ), []
+
+
+def _validate_schedule(row, user_id, companies):
+    errors = []
+    company_id = None
+    if _text(row, "company_id") or _text(row, "company_name"):
+        company_id = _resolve_company(row, companies, errors)
+    title = _text(row, "title")
+    if not title:
+        errors.append("title（タイトル）は必須です")
+    event_type = _text(row, "event_type") or "その他"
+    if event_type not in EVENT_TYPES:
+        errors.append(f"event_type「{event_type}」は種別の一覧にありません")
+    start_at = end_at = None
+    try:
+        start_at = _parse_datetime(_text(row, "start"))
+    except ValueError:
+        errors.append("start（開始日時）が未指定か不正です")
+    if _text(row, "end"):
+        try:
+            end_at = _parse_datetime(_text(row, "end"))
+        except ValueError:
+            errors.append("end の日時が不正です")
+    if start_at and end_at and end_at < start_at:
+        errors.append("end が start より前です")
+    if errors:
+        return None, errors
+    return Schedule(
+        user_id=user_id,
+        company_id=company_id,
+        event_type=event_type,
+        title=title,
+        start_at=start_at,
+        end_at=end_at,
+        location_or_url=_text(row, "location_or_url"),
+        reminder=_parse_bool(row.get("reminder") or False),
+    ), []
+
+
+VALIDATORS = {
+    "companies": _validate_company,
+    "selections": _validate_selection,
+    "schedules": _validate_schedule,
+}
+
+
+# ------------------------------------------------------------------
+# インポート
+# ------------------------------------------------------------------
+def detect_format(filename, requested=None):
+    """format パラメータ，なければ拡張子から csv / jsonl を決める."""
+    fmt = (requested or "").lower() or (filename or "").rsplit(".", 1)[-1].lower()
+    if fmt == "ndjson":
+        fmt = "jsonl"
+    if fmt not in FORMATS:
+        raise ValueError("形式は csv か jsonl で指定してください")
+    return fmt
+
+
+def read_rows(stream, fmt):
+    """バイナリストリームを 1 行ずつ読み，(行番号, 辞書 or None, エラー) を返す."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, None, "JSON として読めません"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "1 行に 1 つのオブジェクトを書いてください"
+            continue
+        yield line_no, row, None
+
+
+def _company_lookup(user_id):
+    """ユーザーの企業を id の集合と名前 → id の辞書で返す（同名は志望度の高い方）."""
+    rows = db.session.execute(
+        db.select(Company.id, Company.name)
+        .where(Company.user_id == user_id)
+        .order_by(Company.preference, Company.id.desc())
+    ).all()
+    return {"ids": {r.id for r in rows}, "names": {r.name: r.id for r in rows}}
+
+
+def import_rows(user_id, kind, rows, batch_size=None):
+    """検証済みの行を batch_size 件ずつ登録し，結果の集計を返す.
+
+    rows は read_rows の戻り値．返り値は
+    {"inserted": 件数, "failed": 件数, "batches": コミット回数, "errors": [{"line", "errors"}]}．
+    """
+    validate = VALIDATORS[kind]
+    batch_size = batch_size or current_app.config.get("IMPORT_BATCH_SIZE", 500)
+    companies = _company_lookup(user_id) if kind != "companies" else None
+    result = {"inserted": 0, "failed": 0, "batches": 0, "errors": []}
+    batch = []
+
+    scheduler = current_app.extensions.get("reminders") if kind == "schedules" else None
+
+    def flush_batch():
+        db.session.add_all(batch)
+        db.session.flush()
+        # commit で属性が expire される前に，後処理に使う値を控えておく
+        reminders = [(obj.id, obj.start_at) for obj in batch if scheduler and obj.reminder]
+        if kind == "selections":
+            # 一覧の current_stage を，今回の選考を含めて企業ごとに再計算する
+            backfill_current_selection({obj.company_id for obj in batch})
+        db.session.commit()
+        for schedule_id, start_at in reminders:
+            scheduler.notify(schedule_id, start_at, True)
+        result["inserted"] += len(batch)
+        result["batches"] += 1
+        batch.clear()
+
+    for line_no, row, error in rows:
+        errors = [error] if error else []
+        obj = None
+        if row is not None:
+            obj, errors = validate(row, user_id, companies)
+        if errors:
+            result["failed"] += 1
+            if len(result["errors"]) < MAX_REPORTED_ERRORS:
+                result["errors"].append({"line": line_no, "errors": errors})
+            continue
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            flush_batch()
+    if batch:
+        flush_batch()
+    return result
+
+
+# ------------------------------------------------------------------
+# エクスポート
+# ------------------------------------------------------------------
+def _export_query(user_id, kind):
+    if kind == "companies":
+        return (
+            db.select(Company)
+            .where(Company.user_id == user_id)
+            .order_by(Company.id)
+        )
+    if kind == "selections":
+        return (
+            db.select(Selection, Company.name)
+            .join(Company, Company.id == Selection.company_id)
+            .where(Company.user_id == user_id)
+            .order_by(Selection.id)
+        )
+    return (
+        db.select(Schedule, Company.name)
+        .outerjoin(Company, Company.id == Schedule.company_id)
+        .where(Schedule.user_id == user_id)
+        .order_by(Schedule.id)
+    )
+
+
+def _export_record(kind, row):
+    if kind == "companies":
+        (obj,) = row
+        return {field: getattr(obj, field) for field in FIELDS[kind]}
+    obj, company_name = row
+    if kind == "selections":
+        record = {field: getattr(obj, field, None) for field in FIELDS[kind]}
+    else:
+        record = {
+            "id": obj.id,
+            "company_id": obj.company_id,
+            "event_type": obj.event_type,
+            "title": obj.title,
+            "start": obj.start_at,
+            "end": obj.end_at,
+            "location_or_url": obj.location_or_url,
+            "reminder": bool(obj.reminder),
+        }
+    record["company_name"] = company_name
+    return record
+
+
+def export_rows(user_id, kind, fmt):
+    """エクスポートの本文を 1 行ずつ返すジェネレータ（CSV は BOM 付き・ヘッダ行あり）."""
+    fields = FIELDS[kind]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\r\n")
+
+    if fmt == "csv":
+        # Excel で文字化けしないよう BOM を付ける
+        writer.writeheader()
+        yield codecs.BOM_UTF8.decode("utf-8") + buffer.getvalue()
+
+    result = db.session.execute(
+        _export_query(user_id, kind).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+    for row in result:
+        record = {k: _format_value(v) for k, v in _export_record(kind, row).items()}
+        if fmt == "csv":
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(record)
+            yield buffer.getvalue()
+        else:
+            yield json.dumps({k: record[k] for k in fields}, ensure_ascii=False) + "\n"
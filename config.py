@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 
 
 def _get_base_dir():
@@ -34,9 +35,91 @@ def _get_database_uri():
     return f"sqlite:///{os.path.join(BASE_DIR, 'syuukatsu.db')}"
 
 
+def _env_int(name, default):
+    """整数の環境変数を読む（未設定・空文字なら既定値）."""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_bool(name, default):
+    """真偽値の環境変数を読む（"0", "false", "no", "off" を偽とみなす）."""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+def _get_engine_options(uri):
+    """SQLAlchemy のエンジン設定を環境変数から組み立てる.
+
+    Neon などホスト型 PostgreSQL はアイドル接続を切断するため，
+    pool_pre_ping と pool_recycle で切れた接続を使い回さないようにする．
+    SQLite はファイル DB なのでプール設定は既定のまま（PRAGMA は app.py で設定）．
+    """
+    if uri.startswith("sqlite"):
+        return {}
+    options = {
+        "pool_size": _env_int("DB_POOL_SIZE", 5),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 5),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 280),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+    }
+    statement_timeout = _env_int("DB_STATEMENT_TIMEOUT_MS", 0)
+    if statement_timeout:
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    return options
+
+
 class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-key-change-in-production")
+    # 鍵のローテーション中に復号に使う以前の SECRET_KEY（カンマ区切り）
+    SECRET_KEY_FALLBACKS = [k for k in os.environ.get("SECRET_KEY_FALLBACKS", "").split(",") if k]
     SQLALCHEMY_DATABASE_URI = _get_database_uri()
+    SQLALCHEMY_ENGINE_OPTIONS = _get_engine_options(SQLALCHEMY_DATABASE_URI)
+    # 起動時にスキーマが古ければその場で init-db 相当を実行する（既定は SQLite のときだけ．
+    # PostgreSQL ではワーカーが同時に DDL を流さないよう，デプロイ時に init-db を実行する）
+    DB_AUTO_INIT = _env_bool("DB_AUTO_INIT", SQLALCHEMY_DATABASE_URI.startswith("sqlite"))
+    # SQLite 使用時に接続ごとに設定する PRAGMA
+    SQLITE_PRAGMAS = {
+        "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000),
+    }
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     WTF_CSRF_ENABLED = True
+    # SQL 件数・処理時間の計測（/_debug/metrics と Server-Timing ヘッダ）
+    INSTRUMENTATION_ENABLED = _env_bool("INSTRUMENTATION", False)
+    QUERY_COUNT_WARN_THRESHOLD = _env_int("QUERY_COUNT_WARN_THRESHOLD", 20)
+    METRICS_WINDOW = _env_int("METRICS_WINDOW", 500)
+    # スケジュールのリマインダー通知（REMINDER_SINK: log / webhook / smtp）
+    REMINDERS_ENABLED = _env_bool("REMINDERS", False)
+    REMINDER_LEAD_MINUTES = _env_int("REMINDER_LEAD_MINUTES", 60)
+    REMINDER_RESYNC_SECONDS = _env_int("REMINDER_RESYNC_SECONDS", 3600)
+    REMINDER_SINK = os.environ.get("REMINDER_SINK", "log")
+    REMINDER_WEBHOOK_URL = os.environ.get("REMINDER_WEBHOOK_URL")
+    REMINDER_SMTP_HOST = os.environ.get("REMINDER_SMTP_HOST", "localhost")
+    REMINDER_SMTP_PORT = _env_int("REMINDER_SMTP_PORT", 25)
+    REMINDER_SMTP_FROM = os.environ.get("REMINDER_SMTP_FROM", "syu-katsu@localhost")
+    REMINDER_SMTP_TO = os.environ.get("REMINDER_SMTP_TO")
+    # 描画済みページのキャッシュ（PAGE_CACHE: memory / filesystem，未設定なら無効）
+    PAGE_CACHE = os.environ.get("PAGE_CACHE")
+    PAGE_CACHE_TTL = _env_int("PAGE_CACHE_TTL", 600)
+    PAGE_CACHE_MAX_BYTES = _env_int("PAGE_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+    PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR") or os.path.join(
+        tempfile.gettempdir(), "syu-katsu-page-cache"
+    )
+    PAGE_CACHE_MAX_ENTRIES = _env_int("PAGE_CACHE_MAX_ENTRIES", 2000)
+    # PDF レポート（バックグラウンドで生成し，REPORT_TTL 秒後に削除）
+    REPORT_DIR = os.environ.get("REPORT_DIR") or os.path.join(
+        tempfile.gettempdir(), "syu-katsu-reports"
+    )
+    REPORT_TTL = _env_int("REPORT_TTL", 3600)
+    REPORT_WORKERS = _env_int("REPORT_WORKERS", 1)
+    PDF_FONT_PATH = os.environ.get("PDF_FONT_PATH")
+    # ES の回答の履歴で，差分の版がこの数だけ続いたら全文（スナップショット）を保存する
+    ES_REVISION_SNAPSHOT_INTERVAL = _env_int("ES_REVISION_SNAPSHOT_INTERVAL", 100)
+    # 一括インポートで 1 トランザクションに登録する行数
+    IMPORT_BATCH_SIZE = _env_int("IMPORT_BATCH_SIZE", 500)
+    # 現在のユーザーをプロセス内にキャッシュする秒数（既定 0 = 無効．変更は他のワーカーに伝わらない）
+    USER_CACHE_TTL = _env_int("USER_CACHE_TTL", 0)
 
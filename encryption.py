@@ -0,0 +1,143 @@
+"""就活管理アプリ — 列の暗号化（マイページのパスワード用）.
+
+SECRET_KEY から HKDF-SHA256 で 256 bit の鍵を導出し，AES-GCM で暗号化する．
+保存形式は "enc1$<鍵 ID>$<base64(nonce + 暗号文)>"．
+
+* 鍵の導出と AESGCM オブジェクトの生成は SECRET_KEY ごとにプロセスで 1 回だけ行う
+* 鍵のローテーション: 新しい SECRET_KEY を設定し，古い値を SECRET_KEY_FALLBACKS に
+  残したまま `flask --app app reencrypt-passwords` を実行する
+* 接頭辞の無い値は暗号化前の平文とみなしてそのまま返す（再暗号化で暗号文に置き換わる）
+"""
+
+import base64
+import hashlib
+import os
+from functools import lru_cache
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from flask import current_app
+from sqlalchemy import String, Text, bindparam, select, type_coerce
+from sqlalchemy.types import TypeDecorator
+
+PREFIX = "enc1"
+NONCE_SIZE = 12
+_HKDF_SALT = b"syu-katsu"
+_HKDF_INFO = b"companies.mypage_password"
+
+
+def _derive_key(secret):
+    return HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=_HKDF_SALT, info=_HKDF_INFO
+    ).derive(secret.encode("utf-8"))
+
+
+@lru_cache(maxsize=4)
+def _keyring(secret, fallbacks):
+    """(現在の鍵 ID, {鍵 ID: AESGCM}) を返す．SECRET_KEY の組ごとに 1 回だけ作る."""
+    ciphers = {}
+    current = None
+    for value in (secret, *fallbacks):
+        key = _derive_key(value)
+        key_id = hashlib.sha256(key).hexdigest()[:8]
+        ciphers.setdefault(key_id, AESGCM(key))
+        current = current or key_id
+    return current, ciphers
+
+
+def keyring():
+    config = current_app.config
+    return _keyring(config["SECRET_KEY"], tuple(config.get("SECRET_KEY_FALLBACKS") or ()))
+
+
+def is_encrypted(value):
+    return value.startswith(PREFIX + "$")
+
+
+def encrypt(plaintext):
+    key_id, ciphers = keyring()
+    nonce = os.urandom(NONCE_SIZE)
+    sealed = nonce + ciphers[key_id].encrypt(nonce, plaintext.encode("utf-8"), None)
+    return f"{PREFIX}${key_id}${base64.urlsafe_b64encode(sealed).decode('ascii')}"
+
+
+def decrypt(value):
+    """暗号文を復号する．平文（暗号化前の既存データ）はそのまま返す."""
+    if not is_encrypted(value):
+        return value
+    _prefix, key_id, payload = value.split("$", 2)
+    cipher = keyring()[1].get(key_id)
+    if cipher is None:
+        raise ValueError(
+            f"鍵 ID {key_id} の暗号文を復号できません（以前の SECRET_KEY を SECRET_KEY_FALLBACKS に設定してください）"
+        )
+    sealed = base64.urlsafe_b64decode(payload)
+    try:
+        plaintext = cipher.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], None)
+    except InvalidTag as e:
+        raise ValueError("暗号文が改ざんされているか，鍵が一致しません") from e
+    return plaintext.decode("utf-8")
+
+
+def needs_rotation(value):
+    """現在の鍵で暗号化されていない値（平文・古い鍵の暗号文）なら True."""
+    return bool(value) and not value.startswith(f"{PREFIX}${keyring()[0]}$")
+
+
+class EncryptedString(TypeDecorator):
+    """書き込み時に暗号化し，読み出し時に復号する文字列型.
+
+    保存する値は平文より長い（接頭辞 + base64(nonce + 暗号文 + タグ)）ため，
+    VARCHAR(n) の上限に当たらないよう Text で持つ．
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if not value:
+            return value
+        return encrypt(value)
+
+    def process_result_value(self, value, dialect):
+        if not value:
+            return value
+        return decrypt(value)
+
+
+def reencrypt_column(session, column, chunk_size=500):
+    """列の値を現在の鍵で暗号化し直す（平文・古い鍵の暗号文が対象）.
+
+    主キー順に chunk_size 件ずつ読み，チャンクごとに UPDATE してコミットする．
+    書き換えた件数を返す．
+    """
+    table = column.table
+    pk = table.primary_key.columns[0]
+    raw = type_coerce(column, String)  # 復号せずに保存値のまま読む
+    last_id = None
+    updated = 0
+    while True:
+        query = select(pk, raw).where(raw.isnot(None), raw != "").order_by(pk).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(pk > last_id)
+        rows = session.execute(query).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        params = [
+            {"_id": row_id, "_value": decrypt(value)}
+            for row_id, value in rows
+            if needs_rotation(value)
+        ]
+        if params:
+            session.execute(
+                table.update()
+                .where(pk == bindparam("_id"))
+                .values({column.name: bindparam("_value", type_=column.type)}),
+                params,
+            )
+        session.commit()
+        updated += len(params)
+    return updated
@@ -1,35 +1,140 @@
-"""Syu_katsu アプリ説明書 PDF 生成スクリプト."""
+"""Syu_katsu アプリ説明書 PDF 生成スクリプト.
 
+ネットワークには接続せず，ローカルのフォント（static/fonts など）を使う．
+フォントは文書で使う文字だけに絞ったサブセットを作り，
+「フォントファイルの内容のハッシュ + 太さ + 文字集合」をキーに _fonts/cache に保存する．
+2 回目以降は同じ内容ならサブセットの作成を省く．
+
+文書は Document に描画命令として記録し，render_pdf() で PDF にする．
+説明書のほか reports.py のユーザー別レポートも同じ処理で描画する．
+
+使い方:
+    python generate_manual_pdf.py
+    python generate_manual_pdf.py --font /path/to/NotoSansCJKjp-VF.ttf --output manual.pdf
+"""
+
+import argparse
+import hashlib
+import io
 import os
 import sys
+import tempfile
 
 from fpdf import FPDF
 
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_DIRS = [os.path.join(APP_DIR, "static", "fonts"), os.path.join(APP_DIR, "_fonts")]
+FONT_CACHE_DIR = os.path.join(APP_DIR, "_fonts", "cache")
+# 日本語を含むフォントの候補（見つかった最初のものを使う．TrueType のみ対応）
+FONT_CANDIDATES = [
+    "NotoSansCJKjp-VF.ttf",
+    "NotoSansJP-VariableFont_wght.ttf",
+    "NotoSansJP-Regular.ttf",
+    "NotoSansCJKjp-Regular.ttf",
+]
+WEIGHTS = {"": 400, "B": 700}
+# 文書に無くても常に含める文字（ページ番号・記号など）
+BASE_CHARS = "0123456789—•…・ "
+
+
+# ------------------------------------------------------------------
+# フォント（ローカル検索・サブセットのキャッシュ）
+# ------------------------------------------------------------------
+def find_font(font_path=None):
+    """使用するフォントファイルのパスを返す（見つからなければ FileNotFoundError）."""
+    font_path = font_path or os.environ.get("PDF_FONT_PATH")
+    if font_path:
+        if not os.path.exists(font_path):
+            raise FileNotFoundError(f"フォントが見つかりません: {font_path}")
+        return font_path
+    for directory in FONT_DIRS:
+        for name in FONT_CANDIDATES:
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                return path
+    raise FileNotFoundError(
+        "日本語フォントが見つかりません。NotoSansCJKjp-VF.ttf などを static/fonts に置くか，"
+        "--font（環境変数 PDF_FONT_PATH）で指定してください"
+    )
+
 
+_file_hashes = {}
+
+
+def _file_hash(path):
+    """フォントファイルの内容のハッシュ（パス・サイズ・更新日時が同じ間はプロセス内で再利用）."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def _build_subset(font_path, chars, weight):
+    """文字集合だけのサブセットを作る．可変フォントは指定の太さで静的なフォントにする."""
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    font = TTFont(font_path, lazy=True)
+    options = subset.Options()
+    options.layout_features = ["*"]
+    options.name_IDs = ["*"]
+    options.notdef_outline = True
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=chars)
+    subsetter.subset(font)
+    # 先に文字を絞ってから太さを固定する（CJK 全体の可変フォントを展開するより速い）
+    if "fvar" in font:
+        from fontTools.varLib import instancer
+
+        axes = {axis.axisTag for axis in font["fvar"].axes}
+        location = {"wght": weight} if "wght" in axes else {}
+        font = instancer.instantiateVariableFont(font, location, updateFontNames=False)
+    buffer = io.BytesIO()
+    font.save(buffer)
+    return buffer.getvalue()
+
+
+def subset_font(font_path, chars, style="", cache_dir=FONT_CACHE_DIR):
+    """サブセットフォントのパスを返す（キャッシュになければ作って保存する）."""
+    chars = "".join(sorted(set(chars) | set(BASE_CHARS)))
+    weight = WEIGHTS[style]
+    key = hashlib.sha256(
+        f"{_file_hash(font_path)}:{weight}:{chars}".encode("utf-8")
+    ).hexdigest()[:32]
+    path = os.path.join(cache_dir, f"{key}.ttf")
+    if os.path.exists(path):
+        return path
+    os.makedirs(cache_dir, exist_ok=True)
+    data = _build_subset(font_path, chars, weight)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return path
+
+
+# ------------------------------------------------------------------
+# PDF
+# ------------------------------------------------------------------
 class ManualPDF(FPDF):
     """日本語対応PDFクラス."""
 
-    def __init__(self):
+    def __init__(self, fonts, header_text="Syu_katsu — 就活管理アプリ 説明書"):
         super().__init__()
-        # Noto Sans JP フォントを使用（Unicode対応）
-        font_url = "https://github.com/googlefonts/noto-cjk/raw/main/Sans/Variable/TTF/NotoSansCJKjp-VF.ttf"
-        font_dir = os.path.join(os.path.dirname(__file__), "_fonts")
-        os.makedirs(font_dir, exist_ok=True)
-        font_path = os.path.join(font_dir, "NotoSansCJKjp-VF.ttf")
-
-        if not os.path.exists(font_path):
-            print("フォントをダウンロード中...")
-            import urllib.request
-            urllib.request.urlretrieve(font_url, font_path)
-            print("ダウンロード完了")
-
-        self.add_font("NotoSansJP", "", font_path, uni=True)
-        self.add_font("NotoSansJP", "B", font_path, uni=True)
+        self.header_text = header_text
+        # fonts: {"": 通常のフォントのパス, "B": 太字のフォントのパス}
+        for style, path in fonts.items():
+            self.add_font("NotoSansJP", style, path)
 
     def header(self):
         self.set_font("NotoSansJP", "B", 10)
         self.set_text_color(100, 100, 100)
-        self.cell(0, 8, "Syu_katsu — 就活管理アプリ 説明書", align="R")
+        self.cell(0, 8, self.header_text, align="R")
         self.ln(12)
 
     def footer(self):
@@ -38,22 +143,22 @@ class ManualPDF(FPDF):
         self.set_text_color(150, 150, 150)
         self.cell(0, 10, f"— {self.page_no()} —", align="C")
 
-    def title_page(self):
+    def title_page(self, title="Syu_katsu", subtitle="就活管理アプリ 説明書", notes=()):
         self.add_page()
         self.ln(60)
         self.set_font("NotoSansJP", "B", 32)
         self.set_text_color(99, 102, 241)
-        self.cell(0, 16, "Syu_katsu", align="C")
+        self.cell(0, 16, title, align="C")
         self.ln(20)
         self.set_font("NotoSansJP", "", 16)
         self.set_text_color(60, 60, 60)
-        self.cell(0, 10, "就活管理アプリ 説明書", align="C")
+        self.cell(0, 10, subtitle, align="C")
         self.ln(40)
         self.set_font("NotoSansJP", "", 11)
         self.set_text_color(120, 120, 120)
-        self.cell(0, 8, "バージョン: 1.0 (MVP)", align="C")
-        self.ln(8)
-        self.cell(0, 8, "最終更新: 2026年2月24日", align="C")
+        for note in notes:
+            self.cell(0, 8, note, align="C")
+            self.ln(8)
 
     def section(self, title):
         self.set_font("NotoSansJP", "B", 16)
@@ -109,12 +214,61 @@ class ManualPDF(FPDF):
         self.ln(3)
 
 
-def main():
-    pdf = ManualPDF()
+class Document:
+    """ManualPDF への描画命令を記録する.
+
+    フォントのサブセットには文書中の全文字が必要なため，先に命令を記録して
+    文字集合を求めてから render_pdf() で ManualPDF に再生する．
+    """
+
+    def __init__(self, header_text="Syu_katsu — 就活管理アプリ 説明書"):
+        self.header_text = header_text
+        self.blocks = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self.blocks.append((name, args, kwargs))
+
+        return record
+
+    def chars(self):
+        """文書で使う文字の集合."""
+        found = set(self.header_text)
+        pending = [value for _name, args, kwargs in self.blocks for value in (*args, *kwargs.values())]
+        while pending:
+            value = pending.pop()
+            if isinstance(value, str):
+                found.update(value)
+            elif isinstance(value, (list, tuple)):
+                pending.extend(value)
+        return "".join(found)
+
+
+def render_pdf(document, output=None, font_path=None, cache_dir=FONT_CACHE_DIR):
+    """記録した文書を PDF にする．output を指定すればファイルに書き，PDF のバイト列を返す."""
+    font_path = find_font(font_path)
+    chars = document.chars()
+    fonts = {style: subset_font(font_path, chars, style, cache_dir) for style in WEIGHTS}
+    pdf = ManualPDF(fonts, document.header_text)
+    for name, args, kwargs in document.blocks:
+        getattr(pdf, name)(*args, **kwargs)
+    data = bytes(pdf.output())
+    if output:
+        with open(output, "wb") as f:
+            f.write(data)
+    return data
+
+
+def manual_document():
+    """アプリ説明書の内容."""
+    pdf = Document()
     pdf.set_auto_page_break(auto=True, margin=20)
 
     # --- 表紙 ---
-    pdf.title_page()
+    pdf.title_page(notes=["バージョン: 1.0 (MVP)", "最終更新: 2026年2月24日"])
 
     # --- 概要 ---
     pdf.add_page()
@@ -254,12 +408,22 @@ def main():
         '  app.py'
     )
     pdf.body_text("出力先: dist/Syu_katsu/")
+    return pdf
+
 
-    # --- 出力 ---
-    output_path = os.path.join(os.path.dirname(__file__), "Syu_katsu_説明書.pdf")
-    pdf.output(output_path)
-    print(f"PDF生成完了: {output_path}")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="アプリ説明書の PDF を生成する")
+    parser.add_argument("--font", help="日本語フォント（TrueType）のパス．省略時は static/fonts などから探す")
+    parser.add_argument("--output", default=os.path.join(APP_DIR, "Syu_katsu_説明書.pdf"))
+    args = parser.parse_args(argv)
+    try:
+        render_pdf(manual_document(), args.output, font_path=args.font)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"PDF生成完了: {args.output}")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""就活管理アプリ — スケジュールの iCalendar（RFC 5545）フィード.
+
+外部のカレンダーアプリから購読する /calendar.ics の本文を作る．
+イベントは yield_per で少しずつ読み，VEVENT を 1 件ずつ文字列で返すため，
+件数が多くても全件をメモリに載せない．
+"""
+
+from datetime import datetime, timezone
+
+from models import Company, Schedule, db
+
+PRODID = "-//Syu_katsu//Schedule Feed//JA"
+TZID = "Asia/Tokyo"
+UID_DOMAIN = "syu-katsu"
+FEED_CHUNK_SIZE = 500
+
+# DB の日時は naive な日本時間なので TZID=Asia/Tokyo を付けて出力する
+_VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    f"TZID:{TZID}",
+    "BEGIN:STANDARD",
+    "DTSTART:19700101T000000",
+    "TZOFFSETFROM:+0900",
+    "TZOFFSETTO:+0900",
+    "TZNAME:JST",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]
+
+
+def _escape(value):
+    """TEXT 型の値をエスケープする（\\ ; , 改行）."""
+    return (
+        (value or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line):
+    """1 行を 75 オクテット以内で折り返す（マルチバイト文字の途中では切らない）."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    current = ""
+    limit = 75
+    for char in line:
+        if len((current + char).encode("utf-8")) > limit:
+            parts.append(current)
+            current = ""
+            limit = 74  # 継続行は先頭の空白 1 文字分短い
+        current += char
+    parts.append(current)
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _local(value):
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+def _utc(value):
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+
+def vevent(schedule, company_name, stamp, alarm_minutes=60):
+    """イベント 1 件分の VEVENT を文字列で返す（リマインダー付きは VALARM も付ける）."""
+    summary = schedule.title
+    if company_name:
+        summary = f"{summary}（{company_name}）"
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:schedule-{schedule.id}@{UID_DOMAIN}",
+        f"DTSTAMP:{_utc(stamp)}",
+        f"DTSTART;TZID={TZID}:{_local(schedule.start_at)}",
+    ]
+    if schedule.end_at and schedule.end_at > schedule.start_at:
+        lines.append(f"DTEND;TZID={TZID}:{_local(schedule.end_at)}")
+    lines.append(f"SUMMARY:{_escape(summary)}")
+    lines.append(f"CATEGORIES:{_escape(schedule.event_type)}")
+    if schedule.location_or_url:
+        key = "URL" if schedule.location_or_url.startswith(("http://", "https://")) else "LOCATION"
+        value = schedule.location_or_url if key == "URL" else _escape(schedule.location_or_url)
+        lines.append(f"{key}:{value}")
+    if schedule.reminder:
+        lines += [
+            "BEGIN:VALARM",
+            "ACTION:DISPLAY",
+            f"DESCRIPTION:{_escape(schedule.title)}",
+            f"TRIGGER:-PT{alarm_minutes}M",
+            "END:VALARM",
+        ]
+    lines.append("END:VEVENT")
+    return "".join(_fold(line) for line in lines)
+
+
+def calendar_feed(user_id, name="就活スケジュール", stamp=None, alarm_minutes=60):
+    """ユーザーのイベントを iCalendar 形式で少しずつ返すジェネレータ."""
+    stamp = stamp or datetime.now(timezone.utc)
+    header = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(name)}",
+        f"X-WR-TIMEZONE:{TZID}",
+        # 購読側のポーリング間隔の目安
+        "REFRESH-INTERVAL;VALUE=DURATION:PT15M",
+        "X-PUBLISHED-TTL:PT15M",
+        *_VTIMEZONE,
+    ]
+    yield "".join(_fold(line) for line in header)
+
+    rows = db.session.execute(
+        db.select(Schedule, Company.name)
+        .outerjoin(Company, Company.id == Schedule.company_id)
+        .where(Schedule.user_id == user_id)
+        .order_by(Schedule.start_at)
+        .execution_options(yield_per=FEED_CHUNK_SIZE)
+    )
+    for schedule, company_name in rows:
+        yield vevent(schedule, company_name, stamp, alarm_minutes)
+    yield _fold("END:VCALENDAR")
@@ -0,0 +1,146 @@
+"""就活管理アプリ — リクエスト単位の SQL 件数・処理時間の計測（オプトイン）.
+
+INSTRUMENTATION=1 で有効化すると次を行う．
+
+* SQLAlchemy の before/after_cursor_execute で SQL の件数と所要時間を数える
+* テンプレート描画時間を signal で計測する
+* レスポンスに Server-Timing ヘッダ（db / render / total）を付ける
+* エンドポイントごとの直近 N 件から p50/p95/p99 を /_debug/metrics で返す
+* SQL 件数が閾値を超えたリクエストを警告ログに出す（N+1 の検知用）
+"""
+
+import math
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import (
+    before_render_template,
+    g,
+    has_request_context,
+    jsonify,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+
+from models import db
+
+
+def percentile(sorted_values, pct):
+    """昇順リストから最近傍順位法でパーセンタイルを求める."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class RouteMetrics:
+    """エンドポイントごとに直近 window 件の計測値を保持する."""
+
+    def __init__(self, window):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, endpoint, total_ms, db_ms, queries):
+        with self._lock:
+            self._samples[endpoint].append((total_ms, db_ms, queries))
+
+    def summary(self):
+        """{endpoint: {count, p50/p95/p99_ms, db_p95_ms, queries_p50, queries_max}} を返す."""
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._samples.items()}
+        result = {}
+        for endpoint, samples in sorted(snapshot.items()):
+            totals = sorted(s[0] for s in samples)
+            db_times = sorted(s[1] for s in samples)
+            queries = sorted(s[2] for s in samples)
+            result[endpoint] = {
+                "count": len(samples),
+                "p50_ms": round(percentile(totals, 50), 2),
+                "p95_ms": round(percentile(totals, 95), 2),
+                "p99_ms": round(percentile(totals, 99), 2),
+                "db_p95_ms": round(percentile(db_times, 95), 2),
+                "queries_p50": percentile(queries, 50),
+                "queries_max": queries[-1],
+            }
+        return result
+
+
+def _current_stats():
+    """計測中のリクエストの集計オブジェクト（リクエスト外なら None）."""
+    if not has_request_context():
+        return None
+    return g.get("_instr")
+
+
+def init_instrumentation(app):
+    """アプリに計測用のフック・Server-Timing・/_debug/metrics を登録する."""
+    metrics = RouteMetrics(app.config.get("METRICS_WINDOW", 500))
+    threshold = app.config.get("QUERY_COUNT_WARN_THRESHOLD", 20)
+    app.extensions["route_metrics"] = metrics
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats()
+        if stats is not None:
+            conn.info.setdefault("_instr_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats()
+        started = conn.info.get("_instr_started")
+        if stats is None or not started:
+            return
+        stats["queries"] += 1
+        stats["db"] += time.perf_counter() - started.pop()
+
+    @before_render_template.connect_via(app)
+    def _before_render(sender, template, context, **extra):
+        stats = _current_stats()
+        if stats is not None:
+            stats["render_started"] = time.perf_counter()
+
+    @template_rendered.connect_via(app)
+    def _after_render(sender, template, context, **extra):
+        stats = _current_stats()
+        if stats is not None and stats.get("render_started"):
+            stats["render"] += time.perf_counter() - stats.pop("render_started")
+
+    @app.before_request
+    def _start_request_timer():
+        g._instr = {"started": time.perf_counter(), "queries": 0, "db": 0.0, "render": 0.0}
+
+    @app.after_request
+    def _record_request(response):
+        stats = g.pop("_instr", None)
+        if stats is None:
+            return response
+        total_ms = (time.perf_counter() - stats["started"]) * 1000
+        db_ms = stats["db"] * 1000
+        render_ms = stats["render"] * 1000
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={db_ms:.2f};desc="{stats["queries"]} queries", '
+            f"render;dur={render_ms:.2f}, total;dur={total_ms:.2f}",
+        )
+        endpoint = request.endpoint or "<unmatched>"
+        if endpoint in ("static", "debug_metrics"):
+            return response
+        metrics.record(endpoint, total_ms, db_ms, stats["queries"])
+        if threshold and stats["queries"] > threshold:
+            app.logger.warning(
+                "%s %s で SQL を %d 件発行しました（閾値 %d）",
+                request.method,
+                request.path,
+                stats["queries"],
+                threshold,
+            )
+        return response
+
+    @app.route("/_debug/metrics")
+    def debug_metrics():
+        return jsonify(metrics.summary())
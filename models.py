@@ -3,6 +3,9 @@
 from datetime import datetime, timezone
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
+
+from encryption import EncryptedString
 
 db = SQLAlchemy()
 
@@ -12,12 +15,17 @@ db = SQLAlchemy()
 # ---------------------------------------------------------------------------
 class User(db.Model):
     __tablename__ = "users"
+    __table_args__ = (
+        # /calendar.ics: 購読 URL のトークンからユーザーを引く
+        db.Index("ix_users_calendar_token", "calendar_token", unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, default="ユーザー")
     email = db.Column(db.String(200), unique=True, nullable=True)
     university = db.Column(db.String(200), nullable=True)
     research_theme = db.Column(db.Text, nullable=True)
+    calendar_token = db.Column(db.String(64), nullable=True)  # カレンダー購読 URL の秘密トークン
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     # リレーション
@@ -31,6 +39,10 @@ class User(db.Model):
 # ---------------------------------------------------------------------------
 class JobAxis(db.Model):
     __tablename__ = "job_axes"
+    __table_args__ = (
+        # axes_list: user_id で絞り priority 順
+        db.Index("ix_job_axes_user_priority", "user_id", "priority"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
@@ -55,29 +67,52 @@ class Company(db.Model):
     preference = db.Column(db.Integer, default=3)  # 1〜5
     mypage_url = db.Column(db.String(500), nullable=True)
     mypage_id = db.Column(db.String(200), nullable=True)
-    mypage_password = db.Column(db.String(500), nullable=True)  # 暗号化して保存
+    # 暗号化して保存（encryption.EncryptedString）．一覧では読まず，参照した時だけ読み込んで復号する
+    mypage_password = db.deferred(db.Column(EncryptedString(), nullable=True))
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # 最新の選考の段階・ステータス（非正規化．選考の追加・更新・削除時に同期する）
+    current_stage = db.Column(db.String(50), nullable=True)
+    current_status = db.Column(db.String(50), nullable=True)
+
+    __table_args__ = (
+        # dashboard / company_list: user_id で絞り志望度の高い順
+        db.Index("ix_companies_user_preference", user_id, preference.desc()),
+        # api_companies / es_list / es_form: user_id で絞り名前順
+        db.Index("ix_companies_user_name", "user_id", "name"),
+        db.Index("ix_companies_user_current_stage", "user_id", "current_stage"),
+    )
+
     # リレーション
     selections = db.relationship("Selection", backref="company", lazy=True, cascade="all, delete-orphan")
     entry_sheets = db.relationship("EntrySheet", backref="company", lazy=True, cascade="all, delete-orphan")
     schedules = db.relationship("Schedule", backref="company", lazy=True)
 
-    @property
-    def latest_selection(self):
-        """最新の選考ステータスを返す."""
-        if not self.selections:
-            return None
-        return max(self.selections, key=lambda s: s.scheduled_at or datetime(1, 1, 1))
-
     @property
     def status_label(self):
         """現在のステータスラベルを返す."""
-        latest = self.latest_selection
-        if latest:
-            return latest.status
-        return "未応募"
+        return self.current_status or "未応募"
+
+    def refresh_current_selection(self):
+        """最新の選考を DB から引き直し current_stage / current_status に反映する.
+
+        commit は呼び出し側で行う（選考の変更と同じトランザクションで確定させる）．
+        """
+        latest = (
+            Selection.query.filter_by(company_id=self.id)
+            .order_by(*latest_selection_order())
+            .first()
+        )
+        self.current_stage = latest.stage if latest else None
+        self.current_status = latest.status if latest else None
+
+
+# パスワードの有無（復号せずに SQL で判定する．company_detail で undefer して使う）
+Company.has_mypage_password = db.column_property(
+    db.and_(Company.mypage_password.isnot(None), Company.mypage_password != ""),
+    deferred=True,
+)
 
 
 # ---------------------------------------------------------------------------
@@ -106,6 +141,10 @@ SELECTION_STATUSES = [
 
 class Selection(db.Model):
     __tablename__ = "selections"
+    __table_args__ = (
+        # 企業ごとの選考一覧・最新の選考の取得
+        db.Index("ix_selections_company_scheduled", "company_id", "scheduled_at"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=False)
@@ -120,6 +159,18 @@ class Selection(db.Model):
     interview_notes = db.relationship("InterviewNote", backref="selection", lazy=True, cascade="all, delete-orphan")
 
 
+def latest_selection_order():
+    """「最新の選考」を先頭にする並び順（current_stage / current_status の基準）.
+
+    scheduled_at の降順で，未設定は最古扱い，同値なら先に登録された方を優先する．
+    """
+    return (
+        Selection.scheduled_at.is_(None),
+        Selection.scheduled_at.desc(),
+        Selection.id,
+    )
+
+
 # ---------------------------------------------------------------------------
 # 面接振り返りノート
 # ---------------------------------------------------------------------------
@@ -127,7 +178,7 @@ class InterviewNote(db.Model):
     __tablename__ = "interview_notes"
 
     id = db.Column(db.Integer, primary_key=True)
-    selection_id = db.Column(db.Integer, db.ForeignKey("selections.id"), nullable=False)
+    selection_id = db.Column(db.Integer, db.ForeignKey("selections.id"), nullable=False, index=True)
     question = db.Column(db.Text, nullable=False)
     answer = db.Column(db.Text, nullable=True)
     reflection = db.Column(db.Text, nullable=True)
@@ -137,18 +188,72 @@ class InterviewNote(db.Model):
 # ---------------------------------------------------------------------------
 # ES（エントリーシート）
 # ---------------------------------------------------------------------------
+ES_STATUSES = ["下書き", "提出済み", "合格", "不合格"]
+
+
 class EntrySheet(db.Model):
     __tablename__ = "entry_sheets"
+    __table_args__ = (
+        # es_list: 企業で結合し締切順
+        db.Index("ix_entry_sheets_company_deadline", "company_id", "deadline"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=False)
     question = db.Column(db.Text, nullable=False)
     answer = db.Column(db.Text, nullable=True)
+    # 回答の文字数（非正規化．answer を代入すると更新される．一覧は本文を読まずにこれを使う）
+    answer_length = db.Column(db.Integer, nullable=True, default=0)
     char_limit = db.Column(db.Integer, nullable=True)
     deadline = db.Column(db.Date, nullable=True)
     status = db.Column(db.String(50), default="下書き")  # 下書き/提出済み/合格/不合格
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # 回答の保存履歴（revisions.py）
+    revisions = db.relationship("EntrySheetRevision", lazy=True, cascade="all, delete-orphan")
+
+    @property
+    def over_limit(self):
+        """回答が字数制限を超えているか."""
+        return bool(self.char_limit) and (self.answer_length or 0) > self.char_limit
+
+
+def answer_length(answer):
+    """回答の文字数（入力欄のカウンターと同じく改行は \\r\\n でも 1 字と数える）."""
+    return len((answer or "").replace("\r", ""))
+
+
+@db.event.listens_for(EntrySheet.answer, "set")
+def _sync_answer_length(target, value, _oldvalue, _initiator):
+    target.answer_length = answer_length(value)
+
+
+# 設問の先頭 81 字（es_list で 80 字 + 省略記号の判定に使う．設問の全文は読まない）
+EntrySheet.question_preview = db.column_property(
+    db.func.substr(EntrySheet.question, 1, 81), deferred=True
+)
+
+
+class EntrySheetRevision(db.Model):
+    """ES の回答の版（保存ごとに 1 行）.
+
+    snapshot の版は回答の全文を，それ以外は直前の版からの差分を圧縮して data に持つ．
+    書き込み・復元は revisions.py で行う．
+    """
+
+    __tablename__ = "entry_sheet_revisions"
+    __table_args__ = (
+        db.Index("ix_entry_sheet_revisions_sheet_number", "entry_sheet_id", "number", unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entry_sheet_id = db.Column(db.Integer, db.ForeignKey("entry_sheets.id"), nullable=False)
+    number = db.Column(db.Integer, nullable=False)  # ES ごとに 1 から連番
+    snapshot = db.Column(db.Boolean, nullable=False, default=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    answer_length = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
 
 # ---------------------------------------------------------------------------
 # スケジュール
@@ -163,6 +268,18 @@ EVENT_TYPES = [
 
 class Schedule(db.Model):
     __tablename__ = "schedules"
+    __table_args__ = (
+        # /api/events の期間検索用（表示期間と重なるイベントだけを引く）
+        db.Index("ix_schedules_user_start", "user_id", "start_at"),
+        db.Index("ix_schedules_user_end", "user_id", "end_at"),
+        # dashboard: 種別で絞った直近イベント（ES締め切りなど）
+        db.Index("ix_schedules_user_type_start", "user_id", "event_type", "start_at"),
+        db.Index("ix_schedules_company_id", "company_id"),
+        # リマインダー: 通知対象のイベントを開始日時順に引く
+        db.Index("ix_schedules_reminder_start", "reminder", "start_at"),
+        # 差分同期: 指定した版数より後に変更されたイベントを引く
+        db.Index("ix_schedules_user_sync_version", "user_id", "sync_version"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
@@ -173,7 +290,197 @@ class Schedule(db.Model):
     end_at = db.Column(db.DateTime, nullable=True)
     location_or_url = db.Column(db.String(500), nullable=True)
     reminder = db.Column(db.Boolean, default=False)
+    reminded_at = db.Column(db.DateTime, nullable=True)  # リマインダー送信日時（未送信は NULL）
+    sync_version = db.Column(db.Integer, nullable=True)  # 最後に変更された時の schedules の版数
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
 
+class ScheduleTombstone(db.Model):
+    """削除したイベントの記録（差分同期で削除を伝えるため）."""
+
+    __tablename__ = "schedule_tombstones"
+    __table_args__ = (db.Index("ix_schedule_tombstones_user_version", "user_id", "version"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    schedule_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)  # 削除時の schedules の版数
+
+
+# ---------------------------------------------------------------------------
+# データ更新の版数（ETag・キャッシュ無効化用）
+# ---------------------------------------------------------------------------
+class DataVersion(db.Model):
+    """ユーザー × 対象（scope）ごとの更新カウンタ.
+
+    対象テーブルへの書き込みがコミットされるたびに version が 1 増える．
+    読み出しは主キー検索 1 回で済むため，一覧の行を読まずに変更の有無を判定できる．
+    """
+
+    __tablename__ = "data_versions"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    scope = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)  # 最後に版数が進んだ日時（UTC, Last-Modified 用）
+
+
+def company_owners(session, company_ids):
+    """企業 id → 所有ユーザー id の dict（after_flush の中から呼ぶ）.
+
+    同じ flush の中では結果を session.info に残して各 after_flush で使い回し，
+    まだ引いていない企業だけを IN (...) の 1 回の SQL で求める．
+    flush 中の企業（削除したものを含む）はインスタンスの user_id を使う．
+    """
+    owners = session.info.setdefault("company_owners", {})
+    missing = {cid for cid in company_ids if cid is not None and cid not in owners}
+    if not missing:
+        return owners
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Company) and obj.id in missing:
+            owners[obj.id] = obj.user_id
+            missing.discard(obj.id)
+    if missing:
+        table = Company.__table__
+        rows = session.connection().execute(
+            db.select(table.c.id, table.c.user_id).where(table.c.id.in_(missing))
+        )
+        owners.update(rows.all())
+    return owners
+
+
+@db.event.listens_for(db.session, "before_flush")
+def _reset_company_owners(session, _flush_context, _instances):
+    # 前の flush（ロールバックされたものを含む）の結果は使わない
+    session.info.pop("company_owners", None)
+
+
+# モデル → scope．選考・ES は企業の所有ユーザー，それ以外は自身の user_id の版数を進める
+VERSIONED_MODELS = {
+    Company: "companies",
+    Schedule: "schedules",
+    Selection: "selections",
+    EntrySheet: "entry_sheets",
+}
+_COMPANY_CHILD_MODELS = (Selection, EntrySheet)
+
+
+def get_versions(user_id, *scopes):
+    """指定した scope の版数を {scope: version} で返す（未更新の scope は 0）."""
+    rows = db.session.execute(
+        db.select(DataVersion.scope, DataVersion.version).where(
+            DataVersion.user_id == user_id, DataVersion.scope.in_(scopes)
+        )
+    )
+    versions = dict.fromkeys(scopes, 0)
+    versions.update(dict(rows.all()))
+    return versions
+
+
+def get_version_rows(user_id, *scopes):
+    """指定した scope の (版数, 更新日時) を返す（未更新の scope は (0, None)）."""
+    rows = db.session.execute(
+        db.select(DataVersion.scope, DataVersion.version, DataVersion.updated_at).where(
+            DataVersion.user_id == user_id, DataVersion.scope.in_(scopes)
+        )
+    )
+    result = {scope: (0, None) for scope in scopes}
+    result.update({scope: (version, updated_at) for scope, version, updated_at in rows})
+    return result
+
+
+@db.event.listens_for(db.session, "after_flush")
+def _bump_data_versions(session, _flush_context):
+    """flush された変更から対象 scope を集め，版数を同じトランザクションで進める."""
+    touched = set()
+    conn = session.connection()
+    dirty = [obj for obj in session.dirty if session.is_modified(obj)]
+    changed = [
+        obj for obj in (*session.new, *dirty, *session.deleted) if type(obj) in VERSIONED_MODELS
+    ]
+    owners = company_owners(
+        session, {obj.company_id for obj in changed if isinstance(obj, _COMPANY_CHILD_MODELS)}
+    )
+    for obj in changed:
+        if isinstance(obj, _COMPANY_CHILD_MODELS):
+            user_id = owners.get(obj.company_id)
+        else:
+            user_id = obj.user_id
+        if user_id is not None:
+            touched.add((user_id, VERSIONED_MODELS[type(obj)]))
+    # イベントの JSON は企業名を含むため，企業名の変更はその企業のイベントの変更として扱う
+    renamed = {}  # user_id → 名前を変えた企業の id
+    for obj in dirty:
+        if isinstance(obj, Company) and inspect(obj).attrs.name.history.has_changes():
+            renamed.setdefault(obj.user_id, []).append(obj.id)
+            touched.add((obj.user_id, "schedules"))
+
+    table = DataVersion.__table__
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for user_id, scope in sorted(touched):
+        # UPDATE で行ロックを取るため，同じユーザーの書き込みはここで直列化される
+        result = conn.execute(
+            table.update()
+            .where(table.c.user_id == user_id, table.c.scope == scope)
+            .values(version=table.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            conn.execute(
+                table.insert().values(user_id=user_id, scope=scope, version=1, updated_at=now)
+            )
+        if scope == "schedules":
+            version = conn.execute(
+                db.select(table.c.version).where(
+                    table.c.user_id == user_id, table.c.scope == scope
+                )
+            ).scalar()
+            _stamp_schedule_changes(
+                conn, session, user_id, version, dirty, renamed.get(user_id, ())
+            )
+
+
+def _stamp_schedule_changes(conn, session, user_id, version, dirty, renamed_companies=()):
+    """変更したイベントに版数を記録し，削除したイベントは tombstone に残す（差分同期用）.
+
+    renamed_companies（名前を変えた企業）のイベントも変更したものとして版数を記録する．
+    """
+    changed = [
+        obj.id
+        for obj in (*session.new, *dirty)
+        if isinstance(obj, Schedule) and obj.user_id == user_id
+    ]
+    schedules = Schedule.__table__
+    if changed:
+        conn.execute(
+            schedules.update().where(schedules.c.id.in_(changed)).values(sync_version=version)
+        )
+    if renamed_companies:
+        conn.execute(
+            schedules.update()
+            .where(schedules.c.company_id.in_(renamed_companies))
+            .values(sync_version=version)
+        )
+    deleted = [
+        {"user_id": user_id, "schedule_id": obj.id, "version": version}
+        for obj in session.deleted
+        if isinstance(obj, Schedule) and obj.user_id == user_id
+    ]
+    if deleted:
+        conn.execute(ScheduleTombstone.__table__.insert(), deleted)
+
 
+# ---------------------------------------------------------------------------
+# スキーマの版（起動時の確認用）
+# ---------------------------------------------------------------------------
+class SchemaVersion(db.Model):
+    """DB に適用済みのスキーマの版（id=1 の 1 行だけ）.
+
+    起動時はこの行を主キーで 1 回読み，モデル定義から求めた版と比べるだけにする．
+    テーブル作成・列追加・初期データの投入は `flask --app app init-db` で行う．
+    """
+
+    __tablename__ = "schema_version"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.String(64), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=True)
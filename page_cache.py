@@ -0,0 +1,272 @@
+"""就活管理アプリ — 描画済みページのキャッシュ（オプトイン）.
+
+PAGE_CACHE=memory / filesystem で有効化すると，dashboard・company_list・
+company_detail の HTML を「ユーザー × 依存するデータの世代」をキーに保存する．
+
+* 世代（generation）は依存先ごとのトークンで，キャッシュ自身に保存する．
+  ヒット時は世代とページを読むだけで，DB への問い合わせは before_request の
+  現在のユーザーの読み込み（USER_CACHE_TTL が 0 のとき 1 件）だけになる
+* 書き込みは after_flush で影響する依存先を集め，commit 後にその世代だけを
+  新しいトークンに差し替える（古いキーのページは二度と参照されず，いずれ追い出される）
+* memory: プロセス内の LRU（合計バイト数で上限）．単一プロセス（exe 版など）向け
+* filesystem: ディレクトリ上のファイル．gunicorn の複数ワーカーで共有できる
+"""
+
+import hashlib
+import os
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+
+from models import Company, Schedule, Selection, company_owners, db
+
+
+# ------------------------------------------------------------------
+# バックエンド
+# ------------------------------------------------------------------
+class MemoryCache:
+    """プロセス内の LRU．ページの合計バイト数が max_bytes を超えたら古い順に捨てる."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()  # key → (期限, 本文)
+        self._size = 0
+        # 世代は小さく数も限られるため LRU の対象外にする（追い出すと古いページが復活しうる）
+        self._generations = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None:
+                return None
+            expires, body = entry
+            if expires < time.time():
+                self._remove(key)
+                return None
+            self._pages.move_to_end(key)
+            return body
+
+    def set(self, key, body, ttl):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._pages:
+                self._remove(key)
+            self._pages[key] = (time.time() + ttl, body)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._pages)))
+
+    def _remove(self, key):
+        _expires, body = self._pages.pop(key)
+        self._size -= len(body)
+
+    def get_generation(self, name):
+        with self._lock:
+            return self._generations.setdefault(name, secrets.token_hex(6))
+
+    def bump_generation(self, name):
+        with self._lock:
+            self._generations[name] = secrets.token_hex(6)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._size = 0
+            self._generations.clear()
+
+
+class FileSystemCache:
+    """ディレクトリ上のファイルに保存する．書き込みは一時ファイル + rename で原子的に行う."""
+
+    PRUNE_EVERY = 64  # この回数の set ごとに件数を確認する
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._pages_dir = os.path.join(directory, "pages")
+        self._gen_dir = os.path.join(directory, "generations")
+        os.makedirs(self._pages_dir, exist_ok=True)
+        os.makedirs(self._gen_dir, exist_ok=True)
+        self._sets = 0
+
+    @staticmethod
+    def _filename(key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def get(self, key):
+        path = os.path.join(self._pages_dir, self._filename(key))
+        try:
+            with open(path, "rb") as f:
+                expires = float(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if expires < time.time():
+            return None
+        return body
+
+    def set(self, key, body, ttl):
+        path = os.path.join(self._pages_dir, self._filename(key))
+        self._write(path, f"{time.time() + ttl}\n".encode() + body)
+        self._sets += 1
+        if self._sets % self.PRUNE_EVERY == 0:
+            self._prune()
+
+    def _prune(self):
+        """期限切れと，max_entries を超えた分の古いファイルを消す."""
+        entries = []
+        for entry in os.scandir(self._pages_dir):
+            if entry.name.startswith("."):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+        entries.sort()
+        for _mtime, path in entries[: max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_generation(self, name):
+        path = os.path.join(self._gen_dir, self._filename(name))
+        try:
+            with open(path, encoding="ascii") as f:
+                return f.read()
+        except OSError:
+            token = secrets.token_hex(6)
+            self._write(path, token.encode("ascii"))
+            return token
+
+    def bump_generation(self, name):
+        path = os.path.join(self._gen_dir, self._filename(name))
+        self._write(path, secrets.token_hex(6).encode("ascii"))
+
+    def clear(self):
+        for directory in (self._pages_dir, self._gen_dir):
+            for entry in os.scandir(directory):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+def build_cache(config):
+    """PAGE_CACHE（memory / filesystem）に応じたバックエンドを作る（無効なら None）."""
+    kind = config.get("PAGE_CACHE")
+    if kind == "memory":
+        return MemoryCache(config.get("PAGE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+    if kind == "filesystem":
+        return FileSystemCache(config["PAGE_CACHE_DIR"], config.get("PAGE_CACHE_MAX_ENTRIES", 2000))
+    return None
+
+
+# ------------------------------------------------------------------
+# ページのキャッシュ
+# ------------------------------------------------------------------
+def cached_page(*dependencies):
+    """GET ビューの HTML をキャッシュするデコレータ.
+
+    dependencies は世代名のテンプレート（例: "companies:{user_id}", "company:{company_id}"）．
+    ビューは g.page_cache_ttl に秒数を入れると，その時刻で期限切れにできる
+    （dashboard の「直近のイベント」のように時刻で表示が変わるページ用）．
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            cache = current_app.extensions.get("page_cache")
+            if cache is None:
+                return view(**kwargs)
+            names = [dep.format(user_id=g.user.id, **kwargs) for dep in dependencies]
+            generations = ".".join(cache.get_generation(name) for name in names)
+            key = f"{request.full_path}|{g.user.id}|{generations}"
+            body = cache.get(key)
+            if body is not None:
+                response = Response(body, mimetype="text/html")
+                response.headers["X-Page-Cache"] = "hit"
+                return response
+
+            rendered = view(**kwargs)
+            if not isinstance(rendered, str):
+                return rendered
+            ttl = current_app.config.get("PAGE_CACHE_TTL", 600)
+            ttl = min(ttl, g.pop("page_cache_ttl", ttl))
+            if ttl > 0:
+                cache.set(key, rendered.encode("utf-8"), ttl)
+            response = Response(rendered, mimetype="text/html")
+            response.headers["X-Page-Cache"] = "miss"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+# ------------------------------------------------------------------
+# 書き込み時の無効化
+# ------------------------------------------------------------------
+@event.listens_for(db.session, "after_flush")
+def _collect_invalidations(session, _flush_context):
+    """flush された変更から，世代を進める依存先を集める（commit 後に反映）."""
+    if not has_app_context() or current_app.extensions.get("page_cache") is None:
+        return
+    names = session.info.setdefault("page_cache_invalidate", set())
+    dirty = [obj for obj in session.dirty if session.is_modified(obj)]
+    changed = (*session.new, *dirty, *session.deleted)
+    owners = company_owners(
+        session, {obj.company_id for obj in changed if isinstance(obj, Selection)}
+    )
+    for obj in changed:
+        if isinstance(obj, Company):
+            names.add(f"companies:{obj.user_id}")
+            names.add(f"company:{obj.id}")
+        elif isinstance(obj, Selection):
+            # 選考は企業一覧の件数・ダッシュボードの段階にも出る
+            names.add(f"companies:{owners.get(obj.company_id)}")
+            names.add(f"company:{obj.company_id}")
+        elif isinstance(obj, Schedule):
+            names.add(f"schedules:{obj.user_id}")
+
+
+@event.listens_for(db.session, "after_commit")
+def _apply_invalidations(session):
+    names = session.info.pop("page_cache_invalidate", None)
+    if not names:
+        return
+    cache = current_app.extensions.get("page_cache")
+    for name in names:
+        cache.bump_generation(name)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_invalidations(session):
+    session.info.pop("page_cache_invalidate", None)
+
+
+def init_page_cache(app):
+    """キャッシュのバックエンドを app.extensions["page_cache"] に登録する."""
+    cache = build_cache(app.config)
+    if cache is not None:
+        app.extensions["page_cache"] = cache
+    return cache
@@ -0,0 +1,257 @@
+"""就活管理アプリ — スケジュールのリマインダー通知.
+
+Schedule.reminder が立っているイベントについて，開始の REMINDER_LEAD_MINUTES 分前に
+通知先（sink）へ送る．ワーカープロセスごとに 1 本のスレッドが次の通知時刻の
+min-heap を持ち，先頭の時刻まで眠る（テーブルのポーリングはしない）．
+
+* heap は (reminder, start_at) インデックスを使うクエリで作り，
+  api_event_create / update / delete からの通知で差分だけ更新する
+* 送信前に schedules.reminded_at を条件付き UPDATE で確保するため，
+  gunicorn で複数ワーカーが同じ heap を持っていても通知は 1 回だけになる
+* 他ワーカーでの変更に備え，REMINDER_RESYNC_SECONDS ごとに heap を作り直す
+"""
+
+import heapq
+import json
+import logging
+import os
+import smtplib
+import threading
+import urllib.request
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from models import Schedule, db
+
+logger = logging.getLogger(__name__)
+
+
+def now_jst():
+    """DB と同じ基準（naive な日本時間）の現在時刻."""
+    return datetime.utcnow() + timedelta(hours=9)
+
+
+# ------------------------------------------------------------------
+# 通知先（sink）
+# ------------------------------------------------------------------
+class LogSink:
+    """アプリのログに出力する（既定）."""
+
+    def send(self, reminder):
+        logger.warning(
+            "リマインド: %s（%s 開始）%s",
+            reminder["title"],
+            reminder["start"],
+            reminder["location_or_url"],
+        )
+
+
+class WebhookSink:
+    """指定 URL に JSON を POST する."""
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, reminder):
+        body = json.dumps(reminder, ensure_ascii=False).encode("utf-8")
+        req = urllib.request.Request(
+            self.url, data=body, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout):
+            pass
+
+
+class SmtpSink:
+    """SMTP でメールを送る（ローカルのテスト用 SMTP サーバーでも可）."""
+
+    def __init__(self, host, port, sender, recipient):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipient = recipient
+
+    def send(self, reminder):
+        message = EmailMessage()
+        message["Subject"] = f"[Syu_katsu] {reminder['title']}"
+        message["From"] = self.sender
+        message["To"] = self.recipient
+        message.set_content(
+            f"{reminder['start']} 開始\n{reminder['location_or_url']}".strip()
+        )
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+
+def build_sink(config):
+    """REMINDER_SINK（log / webhook / smtp）に応じた通知先を作る."""
+    kind = config.get("REMINDER_SINK", "log")
+    if kind == "webhook":
+        return WebhookSink(config["REMINDER_WEBHOOK_URL"])
+    if kind == "smtp":
+        return SmtpSink(
+            config.get("REMINDER_SMTP_HOST", "localhost"),
+            config.get("REMINDER_SMTP_PORT", 25),
+            config.get("REMINDER_SMTP_FROM", "syu-katsu@localhost"),
+            config["REMINDER_SMTP_TO"],
+        )
+    return LogSink()
+
+
+# ------------------------------------------------------------------
+# スケジューラ
+# ------------------------------------------------------------------
+class ReminderScheduler:
+    """次の通知時刻まで眠り，期限が来たリマインダーを sink に送るスレッド."""
+
+    def __init__(self, app, sink, lead, resync_seconds):
+        self.app = app
+        self.sink = sink
+        self.lead = lead
+        self.resync_seconds = resync_seconds
+        self._heap = []  # (通知時刻, schedule_id)
+        self._due = {}  # schedule_id → 有効な通知時刻（heap 内の古いエントリの判定用）
+        self._cond = threading.Condition()
+        self._pid = None
+        self._next_resync = None
+
+    # --- 起動（fork 後のワーカーで 1 回だけ） ---
+    def ensure_started(self):
+        """このプロセスでスレッドが動いていなければ起動する（gunicorn の fork 対策）."""
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._heap = []
+            self._due = {}
+            self._next_resync = None
+        thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        thread.start()
+
+    # --- 差分更新 ---
+    def notify(self, schedule_id, start_at, reminder):
+        """イベントの作成・更新を heap に反映する."""
+        with self._cond:
+            if not reminder or start_at is None:
+                self._due.pop(schedule_id, None)
+            else:
+                due = start_at - self.lead
+                self._due[schedule_id] = due
+                heapq.heappush(self._heap, (due, schedule_id))
+            self._cond.notify()
+
+    def forget(self, schedule_id):
+        """イベントの削除を heap に反映する（古いエントリは取り出し時に捨てる）."""
+        with self._cond:
+            self._due.pop(schedule_id, None)
+
+    # --- ループ本体 ---
+    def _rebuild(self):
+        """通知前のリマインダーを DB から読み直して heap を作り直す."""
+        now = now_jst()
+        rows = db.session.execute(
+            db.select(Schedule.id, Schedule.start_at)
+            .where(
+                Schedule.reminder.is_(True),
+                Schedule.reminded_at.is_(None),
+                Schedule.start_at > now,
+            )
+            .order_by(Schedule.start_at)
+        ).all()
+        with self._cond:
+            self._due = {sid: start - self.lead for sid, start in rows}
+            self._heap = [(due, sid) for sid, due in self._due.items()]
+            heapq.heapify(self._heap)
+            self._next_resync = now + timedelta(seconds=self.resync_seconds)
+
+    def _pop_due(self):
+        """期限の来たエントリを 1 件返す．なければ次の期限まで待って None を返す."""
+        with self._cond:
+            while self._heap:
+                due, schedule_id = self._heap[0]
+                if self._due.get(schedule_id) != due:
+                    heapq.heappop(self._heap)  # 更新・削除済みの古いエントリ
+                    continue
+                wait = (due - now_jst()).total_seconds()
+                if wait <= 0:
+                    heapq.heappop(self._heap)
+                    del self._due[schedule_id]
+                    return schedule_id
+                break
+            else:
+                wait = None
+            until_resync = (self._next_resync - now_jst()).total_seconds()
+            timeout = until_resync if wait is None else min(wait, until_resync)
+            if timeout > 0:
+                self._cond.wait(timeout)
+        return None
+
+    def _fire(self, schedule_id):
+        """DB 上で通知済みを確保できたら sink に送る."""
+        schedule = db.session.get(Schedule, schedule_id)
+        if schedule is None or not schedule.reminder or schedule.reminded_at is not None:
+            return
+        due = schedule.start_at - self.lead
+        if due > now_jst():
+            # 他ワーカーで日時が変更されていた場合は新しい時刻で積み直す
+            self.notify(schedule.id, schedule.start_at, schedule.reminder)
+            return
+        table = Schedule.__table__
+        claimed = db.session.execute(
+            table.update()
+            .where(table.c.id == schedule_id, table.c.reminded_at.is_(None))
+            .values(reminded_at=now_jst())
+        ).rowcount
+        db.session.commit()
+        if claimed != 1:
+            return
+        try:
+            self.sink.send(
+                {
+                    "id": schedule.id,
+                    "title": schedule.title,
+                    "event_type": schedule.event_type,
+                    "start": schedule.start_at.isoformat(),
+                    "location_or_url": schedule.location_or_url or "",
+                }
+            )
+        except Exception:
+            # 送信に失敗したら確保を戻し，次の再構築で再送できるようにする
+            db.session.execute(
+                table.update().where(table.c.id == schedule_id).values(reminded_at=None)
+            )
+            db.session.commit()
+            raise
+
+    def _run(self):
+        with self.app.app_context():
+            self._rebuild()
+        while True:
+            try:
+                if now_jst() >= self._next_resync:
+                    with self.app.app_context():
+                        self._rebuild()
+                schedule_id = self._pop_due()
+                if schedule_id is None:
+                    continue
+                with self.app.app_context():
+                    self._fire(schedule_id)
+            except Exception:
+                logger.exception("リマインダーの処理に失敗しました")
+                with self._cond:
+                    self._cond.wait(30)
+
+
+def init_reminders(app):
+    """スケジューラを登録し，各ワーカーの最初のリクエストで起動する."""
+    scheduler = ReminderScheduler(
+        app,
+        build_sink(app.config),
+        timedelta(minutes=app.config.get("REMINDER_LEAD_MINUTES", 60)),
+        app.config.get("REMINDER_RESYNC_SECONDS", 3600),
+    )
+    app.extensions["reminders"] = scheduler
+    app.before_request(scheduler.ensure_started)
+    return scheduler
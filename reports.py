@@ -0,0 +1,229 @@
+"""就活管理アプリ — ユーザー別 PDF レポートのバックグラウンド生成.
+
+PDF の描画（フォントのサブセット作成を含む）はリクエストの中では行わず，
+ワーカープロセスごとのスレッドプールで実行する．リクエストには job id を返し，
+クライアントは状態 API をポーリングして完成後に PDF を取得する．
+
+* ジョブの状態は REPORT_DIR のファイルで持つ（gunicorn の別ワーカーが処理しても参照できる）
+    - <job id>.json: 依頼者と種類（作成時）
+    - <job id>.pdf / <job id>.error: 完成した PDF / 失敗理由
+* 書き込みは一時ファイル + rename で行い，作りかけのファイルは見えない
+* REPORT_TTL 秒より古いファイルは新しいジョブの受付時に消す
+* 描画は generate_manual_pdf.render_pdf（説明書と同じ処理）を使う
+"""
+
+import json
+import logging
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+import analytics
+from models import Company, Schedule, SELECTION_STAGES, User, db
+
+logger = logging.getLogger(__name__)
+
+REPORT_KINDS = {"summary": "企業・選考サマリー", "funnel": "選考ファネル分析"}
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+# ------------------------------------------------------------------
+# レポートの内容
+# ------------------------------------------------------------------
+def _clip(value, length=24):
+    value = value or ""
+    return value if len(value) <= length else value[: length - 1] + "…"
+
+
+def company_summary_document(user_id):
+    """企業・選考状況のサマリー（段階ごとの社数・企業一覧・今後の予定）."""
+    from generate_manual_pdf import Document
+
+    now = datetime.utcnow() + timedelta(hours=9)
+    user = db.session.get(User, user_id)
+    doc = Document(header_text="Syu_katsu — 企業・選考サマリー")
+    doc.set_auto_page_break(auto=True, margin=20)
+    doc.add_page()
+    doc.section("企業・選考サマリー")
+    doc.body_text(f"{user.name} さん／作成日時: {now:%Y年%m月%d日 %H:%M}")
+
+    # 段階ごとの社数は SQL で集計する（企業を全件読まない）
+    counts = dict(
+        db.session.execute(
+            db.select(Company.current_stage, func.count())
+            .where(Company.user_id == user_id)
+            .group_by(Company.current_stage)
+        ).all()
+    )
+    doc.subsection("選考段階ごとの社数")
+    doc.table_row(["段階", "社数"], header=True)
+    for stage in [None, *SELECTION_STAGES]:
+        if counts.get(stage):
+            doc.table_row([stage or "未応募", str(counts[stage])])
+    doc.table_row(["合計", str(sum(counts.values()))])
+
+    doc.subsection("企業一覧（志望度順）")
+    doc.table_row(["企業名", "業界", "志望度", "ステータス"], header=True)
+    rows = db.session.execute(
+        db.select(Company.name, Company.industry, Company.preference, Company.current_status)
+        .where(Company.user_id == user_id)
+        .order_by(Company.preference.desc(), Company.name)
+    )
+    for name, industry, preference, status in rows:
+        doc.table_row(
+            [_clip(name), _clip(industry), "★" * (preference or 0), status or "未応募"]
+        )
+
+    doc.subsection("今後の予定")
+    upcoming = db.session.execute(
+        db.select(Schedule.start_at, Schedule.title, Company.name)
+        .outerjoin(Company, Company.id == Schedule.company_id)
+        .where(Schedule.user_id == user_id, Schedule.start_at >= now)
+        .order_by(Schedule.start_at)
+        .limit(30)
+    ).all()
+    if not upcoming:
+        doc.body_text("予定はありません．")
+    for start_at, title, company_name in upcoming:
+        suffix = f"（{company_name}）" if company_name else ""
+        doc.bullet(f"{start_at:%m/%d %H:%M}  {title}{suffix}")
+    return doc
+
+
+REPORT_BUILDERS = {"summary": company_summary_document, "funnel": analytics.funnel_document}
+
+
+# ------------------------------------------------------------------
+# ジョブ
+# ------------------------------------------------------------------
+class ReportRunner:
+    """レポートの生成をスレッドプールで実行し，状態を REPORT_DIR のファイルで管理する."""
+
+    def __init__(self, app, directory, ttl, max_workers=1):
+        self.app = app
+        self.directory = directory
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.directory, f"{job_id}.{ext}")
+
+    def _write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _pool(self):
+        """このプロセスのスレッドプール（fork 前に作ったものは使わない）."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="report"
+                )
+            return self._executor
+
+    # --- 受付・状態 ---
+    def font_error(self):
+        """PDF に使う日本語フォントが無ければその理由（あれば None）."""
+        from generate_manual_pdf import find_font
+
+        try:
+            find_font(self.app.config.get("PDF_FONT_PATH"))
+        except FileNotFoundError as e:
+            return str(e)
+        return None
+
+    def submit(self, user_id, kind):
+        """ジョブを登録して job id を返す（生成はバックグラウンドで行う）."""
+        self._cleanup()
+        job_id = secrets.token_hex(16)
+        meta = {"user_id": user_id, "kind": kind, "created_at": time.time()}
+        self._write(self._path(job_id, "json"), json.dumps(meta).encode("utf-8"))
+        self._pool().submit(self._run, job_id, user_id, kind)
+        return job_id
+
+    def _meta(self, job_id, user_id):
+        """依頼者が一致するジョブの情報（無ければ None）."""
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._path(job_id, "json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("user_id") == user_id else None
+
+    def status(self, job_id, user_id):
+        """{"status": "pending" / "done" / "failed", ...}．ジョブが無ければ None."""
+        meta = self._meta(job_id, user_id)
+        if meta is None:
+            return None
+        if os.path.exists(self._path(job_id, "pdf")):
+            return {"status": "done", "kind": meta["kind"]}
+        try:
+            with open(self._path(job_id, "error"), encoding="utf-8") as f:
+                return {"status": "failed", "kind": meta["kind"], "error": f.read()}
+        except OSError:
+            return {"status": "pending", "kind": meta["kind"]}
+
+    def pdf_path(self, job_id, user_id):
+        """完成した PDF のパス（未完成・他ユーザーのジョブなら None）."""
+        if self._meta(job_id, user_id) is None:
+            return None
+        path = self._path(job_id, "pdf")
+        return path if os.path.exists(path) else None
+
+    # --- 実行 ---
+    def _run(self, job_id, user_id, kind):
+        from generate_manual_pdf import render_pdf
+
+        try:
+            with self.app.app_context():
+                document = REPORT_BUILDERS[kind](user_id)
+                db.session.remove()  # 描画中は DB の接続を持たない
+                data = render_pdf(document, font_path=self.app.config.get("PDF_FONT_PATH"))
+            self._write(self._path(job_id, "pdf"), data)
+        except Exception as e:
+            logger.exception("レポートの生成に失敗しました（job %s）", job_id)
+            message = str(e) if isinstance(e, FileNotFoundError) else "レポートの生成に失敗しました"
+            self._write(self._path(job_id, "error"), message.encode("utf-8"))
+
+    def _cleanup(self):
+        """REPORT_TTL より古いジョブのファイルを消す."""
+        limit = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+
+def init_reports(app):
+    """ReportRunner を app.extensions["reports"] に登録する."""
+    runner = ReportRunner(
+        app,
+        app.config["REPORT_DIR"],
+        app.config.get("REPORT_TTL", 3600),
+        app.config.get("REPORT_WORKERS", 1),
+    )
+    app.extensions["reports"] = runner
+    return runner
@@ -0,0 +1,179 @@
+"""就活管理アプリ — ES の回答の保存履歴（差分を圧縮して保存）.
+
+ES を保存するたびに回答を新しい版として entry_sheet_revisions に記録する．
+全文を毎回持つと自動保存・細かい修正のたびに ES 1 件分ずつ増えるため，
+
+* 通常の版は直前の版からの差分（残す範囲と挿入した文字列の列）を deflate で圧縮して持つ
+* 次のどちらかに当たる版はスナップショット（全文を圧縮）にする
+    - 直前のスナップショットから SNAPSHOT_INTERVAL 版目
+    - 直前のスナップショット以降の差分の合計が，全文を圧縮した大きさの CHAIN_RATIO 倍を超える
+* 任意の版は「その版以前で最新のスナップショット + 以降の差分」を 1 回の SQL で読んで復元する
+  （適用する差分は SNAPSHOT_INTERVAL 個以下，読むバイト数は全文の CHAIN_RATIO + 1 倍以下）
+
+保存量は「各保存で変えた部分」の合計にスナップショットの分（その 1/CHAIN_RATIO 程度）を
+足した大きさになり，保存の回数ではなく編集の量に比例する．
+"""
+
+import difflib
+import json
+import zlib
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import EntrySheetRevision, answer_length, db
+
+SNAPSHOT_INTERVAL = 100
+CHAIN_RATIO = 4
+
+_PLAIN = b"j"
+_DEFLATE = b"z"
+
+
+# ------------------------------------------------------------------
+# 差分
+# ------------------------------------------------------------------
+def _opcodes(old, new):
+    return difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes()
+
+
+def _delta(old, new):
+    """old → new の差分．[開始, 終了]（old から残す範囲）と挿入する文字列の列."""
+    ops = []
+    for tag, i1, i2, j1, j2 in _opcodes(old, new):
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:  # replace / insert
+            ops.append(new[j1:j2])
+    return ops
+
+
+def _apply(old, ops):
+    return "".join(old[op[0] : op[1]] if isinstance(op, list) else op for op in ops)
+
+
+def _pack(value):
+    """JSON にして圧縮する（数十バイトの差分は圧縮すると大きくなるため，小さい方を先頭 1 バイトで区別）."""
+    raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)  # ヘッダ・チェックサムなしの deflate
+    packed = compressor.compress(raw) + compressor.flush()
+    return _DEFLATE + packed if len(packed) < len(raw) else _PLAIN + raw
+
+
+def _unpack(data):
+    body = data[1:]
+    if data[:1] == _DEFLATE:
+        body = zlib.decompress(body, -15)
+    return json.loads(body.decode())
+
+
+def _text(revisions):
+    """スナップショットから始まる版の列を順に適用し，最後の版の回答を返す."""
+    text = None
+    for revision in revisions:
+        value = _unpack(revision.data)
+        text = value if revision.snapshot else _apply(text, value)
+    return text
+
+
+def diff_segments(old, new):
+    """表示用の差分 [(種類, 文字列)]．種類は "equal" / "delete" / "insert"."""
+    segments = []
+    for tag, i1, i2, j1, j2 in _opcodes(old, new):
+        if tag == "equal":
+            segments.append(("equal", old[i1:i2]))
+            continue
+        if i2 > i1:
+            segments.append(("delete", old[i1:i2]))
+        if j2 > j1:
+            segments.append(("insert", new[j1:j2]))
+    return segments
+
+
+# ------------------------------------------------------------------
+# 読み出し
+# ------------------------------------------------------------------
+def _chain(entry_sheet_id, number=None):
+    """number の版（省略時は最新版）の復元に使う版（直前のスナップショットから順に）."""
+    conditions = [EntrySheetRevision.entry_sheet_id == entry_sheet_id]
+    if number is not None:
+        conditions.append(EntrySheetRevision.number <= number)
+    base = (
+        db.select(func.max(EntrySheetRevision.number))
+        .where(*conditions, EntrySheetRevision.snapshot.is_(True))
+        .scalar_subquery()
+    )
+    return (
+        EntrySheetRevision.query.filter(*conditions, EntrySheetRevision.number >= base)
+        .order_by(EntrySheetRevision.number)
+        .all()
+    )
+
+
+def reconstruct(entry_sheet_id, number):
+    """number の版の回答（その版が無ければ None）."""
+    chain = _chain(entry_sheet_id, number)
+    if not chain or chain[-1].number != number:
+        return None
+    return _text(chain)
+
+
+def history(entry_sheet_id):
+    """版の一覧（新しい順．回答は復元せず，保存サイズは SQL で求める）."""
+    return db.session.execute(
+        db.select(
+            EntrySheetRevision.number,
+            EntrySheetRevision.snapshot,
+            EntrySheetRevision.answer_length,
+            EntrySheetRevision.created_at,
+            func.length(EntrySheetRevision.data).label("stored_bytes"),
+        )
+        .where(EntrySheetRevision.entry_sheet_id == entry_sheet_id)
+        .order_by(EntrySheetRevision.number.desc())
+    ).all()
+
+
+# ------------------------------------------------------------------
+# 書き込み
+# ------------------------------------------------------------------
+def _add(entry_sheet_id, number, text, chain, base):
+    """chain（直前のスナップショットから直前の版まで）に続く版を追加する.
+
+    base は直前の版の回答．スナップショットにするかはここで決める．
+    """
+    full = _pack(text)
+    interval = current_app.config.get("ES_REVISION_SNAPSHOT_INTERVAL", SNAPSHOT_INTERVAL)
+    snapshot = not chain or len(chain) >= interval
+    if not snapshot:
+        delta = _pack(_delta(base, text))
+        # 差分の合計が全文の CHAIN_RATIO 倍を超えたら全文を持つ（復元時に読む量を抑える）
+        chained = sum(len(r.data) for r in chain if not r.snapshot) + len(delta)
+        snapshot = chained > CHAIN_RATIO * len(full)
+    revision = EntrySheetRevision(
+        entry_sheet_id=entry_sheet_id,
+        number=number,
+        snapshot=snapshot,
+        data=full if snapshot else delta,
+        answer_length=answer_length(text),
+    )
+    db.session.add(revision)
+    return revision
+
+
+def record_revision(es, previous=None):
+    """es.answer を新しい版として記録する（最新版と同じなら何もしない）．commit は呼び出し側で行う.
+
+    previous には編集前の回答を渡す．履歴がまだ無い ES（履歴の機能より前に作った ES）では，
+    それを最初の版として残してから今回の版を記録する．
+    """
+    if es.id is None:
+        db.session.flush()
+    text = es.answer or ""
+    chain = _chain(es.id)
+    base = _text(chain)
+    if not chain and previous and previous != text:
+        chain, base = [_add(es.id, 1, previous, [], None)], previous
+    if base == text or (base is None and not text):
+        return None
+    number = chain[-1].number + 1 if chain else 1
+    return _add(es.id, number, text, chain, base)
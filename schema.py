@@ -0,0 +1,196 @@
+"""就活管理アプリ — データベースの初期化・スキーマ追従・データ補完.
+
+起動時（create_app）は schema_version の 1 行を読んでモデル定義の版と比べるだけにし，
+テーブル作成・列追加・データ補完・初期ユーザーの作成は init_database()
+（`flask --app app init-db`）にまとめる．
+"""
+
+import hashlib
+from datetime import datetime, timezone
+
+from sqlalchemy import String, inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from models import (
+    Company,
+    EntrySheet,
+    SchemaVersion,
+    Selection,
+    User,
+    db,
+    latest_selection_order,
+)
+from search import SearchDocument, init_search, rebuild_search_index
+
+# モデル定義に現れない変更（全文検索の DDL・データの補完処理など）を入れたら上げる
+SCHEMA_REVISION = 1
+
+
+# ------------------------------------------------------------------
+# 版の確認（起動時）
+# ------------------------------------------------------------------
+def schema_fingerprint():
+    """モデル定義（テーブル・列・型・インデックス）と SCHEMA_REVISION から求めた版."""
+    digest = hashlib.sha256(f"revision:{SCHEMA_REVISION}".encode())
+    for table in sorted(db.metadata.sorted_tables, key=lambda t: t.name):
+        digest.update(f"\ntable:{table.name}".encode())
+        for column in table.columns:
+            digest.update(f"\n{column.name}:{column.type!r}".encode())
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            digest.update(f"\nindex:{index.name}".encode())
+    return digest.hexdigest()[:16]
+
+
+def current_schema_version():
+    """DB に記録された版（未作成・記録前なら None）．主キー検索 1 回だけ."""
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.select(SchemaVersion.version).where(SchemaVersion.id == 1)
+            ).scalar()
+    except (OperationalError, ProgrammingError):
+        return None
+
+
+def schema_is_current():
+    return current_schema_version() == schema_fingerprint()
+
+
+# ------------------------------------------------------------------
+# 初期化（CLI: init-db）
+# ------------------------------------------------------------------
+def init_database():
+    """テーブル作成・列追加・データ補完・初期ユーザー作成を行い，版を記録する.
+
+    何度実行してもよい．追加した列・インデックスの名前を返す．
+    """
+    db.create_all()
+    # create_all は既存テーブルに列・インデックスを追加しないため個別に追従
+    added = upgrade_schema()
+    if "companies.current_stage" in added:
+        backfill_current_selection()
+    backfill_answer_length()
+    # 全文検索インデックス（初回は既存データから文書を作る）
+    init_search()
+    if SearchDocument.query.first() is None and Company.query.first() is not None:
+        rebuild_search_index()
+    if not User.query.first():
+        db.session.add(User(name="ユーザー"))
+    db.session.merge(
+        SchemaVersion(
+            id=1,
+            version=schema_fingerprint(),
+            applied_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        )
+    )
+    db.session.commit()
+    return added
+
+
+def _needs_widening(model_type, db_type):
+    """DB の VARCHAR(n) がモデルの文字列型（長さ指定なし・Text を含む）より短いなら True."""
+    model_type = getattr(model_type, "impl_instance", model_type)  # TypeDecorator は元の型で比べる
+    db_length = getattr(db_type, "length", None)
+    if db_length is None or not isinstance(model_type, String):
+        return False
+    return model_type.length is None or model_type.length > db_length
+
+
+def upgrade_schema():
+    """create_all では追加されない列・インデックスを既存テーブルに追加する.
+
+    SQLite 以外では，モデルより短い VARCHAR 列の型も広げる（SQLite は長さを検査しない）．
+    追加・変更した列は "テーブル名.列名"，インデックスはインデックス名で返す．
+    """
+    inspector = inspect(db.engine)
+    added = []
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    if conn.dialect.name != "sqlite" and _needs_widening(
+                        column.type, existing[column.name]
+                    ):
+                        col_type = column.type.compile(dialect=conn.dialect)
+                        conn.execute(
+                            text(
+                                f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE {col_type}"
+                            )
+                        )
+                        added.append(f"{table.name}.{column.name}")
+                    continue
+                # 後から追加する列は NULL 許可（既存行は後続の補完処理で埋める）
+                col_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+                added.append(f"{table.name}.{column.name}")
+
+    for table in db.metadata.sorted_tables:
+        existing = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            index.create(db.engine, checkfirst=True)
+            added.append(index.name)
+    return added
+
+
+def backfill_current_selection(company_ids=None):
+    """企業の current_stage / current_status を選考テーブルから再計算する.
+
+    企業ごとの最新の選考をウィンドウ関数 1 回で求め，一括 UPDATE する．
+    company_ids を渡した場合はその企業だけを対象にする（省略時は全企業）．
+    更新した企業数を返す．
+    """
+    ranked = db.select(
+        Selection.company_id,
+        Selection.stage,
+        Selection.status,
+        db.func.row_number()
+        .over(partition_by=Selection.company_id, order_by=latest_selection_order())
+        .label("rn"),
+    )
+    companies = db.select(Company.id)
+    if company_ids is not None:
+        ranked = ranked.where(Selection.company_id.in_(company_ids))
+        companies = companies.where(Company.id.in_(company_ids))
+    ranked = ranked.subquery()
+    latest = {
+        row.company_id: row
+        for row in db.session.execute(
+            db.select(ranked.c.company_id, ranked.c.stage, ranked.c.status).where(ranked.c.rn == 1)
+        )
+    }
+
+    params = []
+    for (company_id,) in db.session.execute(companies):
+        row = latest.get(company_id)
+        params.append(
+            {
+                "id": company_id,
+                "current_stage": row.stage if row else None,
+                "current_status": row.status if row else None,
+            }
+        )
+    if params:
+        db.session.execute(db.update(Company), params)
+    db.session.commit()
+    return len(params)
+
+
+def backfill_answer_length():
+    """answer_length が未設定の ES の文字数を UPDATE 1 回で埋める.
+
+    数え方は models.answer_length と同じ（改行の \\r は数えない）．更新した ES の件数を返す．
+    """
+    result = db.session.execute(
+        db.update(EntrySheet)
+        .where(EntrySheet.answer_length.is_(None))
+        .values(
+            answer_length=db.func.length(
+                db.func.replace(db.func.coalesce(EntrySheet.answer, ""), "\r", "")
+            )
+        )
+    )
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,361 @@
+"""就活管理アプリ — ES 回答・面接ノート・企業メモの全文検索.
+
+テキストは NFKC 正規化した上で文字 bigram に分割して search_documents に保存し，
+バックエンドごとの全文検索インデックスで引く．
+
+* SQLite: search_documents を外部コンテンツとする FTS5 仮想テーブル（トリガで同期）
+* PostgreSQL: to_tsvector('simple', tokens) の GIN 式インデックス
+
+元データ（EntrySheet / InterviewNote / Company / Selection）への書き込みは
+after_flush で検知し，同じトランザクション内で search_documents を更新する．
+"""
+
+import re
+import unicodedata
+
+from sqlalchemy import event, text
+
+from models import Company, EntrySheet, InterviewNote, Selection, company_owners, db
+
+SEARCH_LIMIT = 50
+SNIPPET_RADIUS = 40
+REBUILD_BATCH_SIZE = 1000  # 再構築時に 1 回で読み・INSERT する件数
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class SearchDocument(db.Model):
+    """検索対象 1 件（ES・面接ノート・企業・選考の振り返り）."""
+
+    __tablename__ = "search_documents"
+    __table_args__ = (
+        db.UniqueConstraint("doc_type", "doc_id", name="uq_search_documents_doc"),
+        db.Index("ix_search_documents_user", "user_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    doc_type = db.Column(db.String(20), nullable=False)  # es / note / company / selection
+    doc_id = db.Column(db.Integer, nullable=False)
+    company_id = db.Column(db.Integer, nullable=True)
+    title = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    tokens = db.Column(db.Text, nullable=False)  # 文字 bigram を空白区切りにしたもの
+
+
+# ------------------------------------------------------------------
+# トークナイズ（文字 bigram）
+# ------------------------------------------------------------------
+def _normalize(value):
+    return unicodedata.normalize("NFKC", value or "").lower()
+
+
+def _bigrams(word):
+    """1 語を文字 bigram に分割する．1 文字の語はそのまま返す."""
+    if len(word) == 1:
+        return [word]
+    return [word[i : i + 2] for i in range(len(word) - 1)]
+
+
+def tokenize(value):
+    """文書側のトークン列．各語の末尾 1 文字も加え，1 文字検索を前方一致で拾えるようにする."""
+    tokens = []
+    for word in _WORD_RE.findall(_normalize(value)):
+        tokens.extend(_bigrams(word))
+        if len(word) > 1:
+            tokens.append(word[-1])
+    return " ".join(tokens)
+
+
+def _query_terms(query):
+    """検索語を語ごとの bigram リストにする（空白区切りは AND）."""
+    return [_bigrams(word) for word in _WORD_RE.findall(_normalize(query))]
+
+
+# ------------------------------------------------------------------
+# 文書の組み立て
+# ------------------------------------------------------------------
+def _join(*parts):
+    return "\n".join(p for p in parts if p)
+
+
+def _document_text(doc_type, obj):
+    """(タイトル, 本文)．obj はモデルのインスタンスか，同じ名前の列を持つ行."""
+    if doc_type == "es":
+        return obj.question or "", _join(obj.question, obj.answer)
+    if doc_type == "note":
+        return obj.question or "", _join(obj.question, obj.answer, obj.reflection)
+    if doc_type == "company":
+        return obj.name or "", _join(obj.name, obj.description, obj.notes)
+    return f"{obj.stage} の振り返り", obj.feedback or ""
+
+
+def _build_document(doc_type, obj, company_id, user_id):
+    """検索文書の値を作る（本文が空・企業が無ければ None）."""
+    title, body = _document_text(doc_type, obj)
+    if not body.strip() or company_id is None or user_id is None:
+        return None
+    return {
+        "user_id": user_id,
+        "doc_type": doc_type,
+        "doc_id": obj.id,
+        "company_id": company_id,
+        "title": title[:200],
+        "body": body,
+        "tokens": tokenize(body),
+    }
+
+
+_DOC_TYPES = {EntrySheet: "es", InterviewNote: "note", Company: "company", Selection: "selection"}
+
+
+def _document_companies(conn, objs):
+    """{インスタンス: 企業 id}．面接ノートの企業は選考をまとめて 1 回の SQL で引く."""
+    selection_ids = {obj.selection_id for obj in objs if isinstance(obj, InterviewNote)}
+    note_companies = {}
+    if selection_ids:
+        table = Selection.__table__
+        note_companies = dict(
+            conn.execute(
+                db.select(table.c.id, table.c.company_id).where(table.c.id.in_(selection_ids))
+            ).all()
+        )
+    companies = {}
+    for obj in objs:
+        if isinstance(obj, Company):
+            companies[obj] = obj.id
+        elif isinstance(obj, InterviewNote):
+            companies[obj] = note_companies.get(obj.selection_id)
+        else:
+            companies[obj] = obj.company_id
+    return companies
+
+
+def _delete_documents(conn, keys):
+    """(文書の種類, 元データの id) の文書を種類ごとにまとめて削除する."""
+    table = SearchDocument.__table__
+    by_type = {}
+    for doc_type, doc_id in keys:
+        by_type.setdefault(doc_type, []).append(doc_id)
+    for doc_type, doc_ids in by_type.items():
+        conn.execute(
+            table.delete().where(table.c.doc_type == doc_type, table.c.doc_id.in_(doc_ids))
+        )
+
+
+@event.listens_for(db.session, "after_flush")
+def _sync_search_documents(session, _flush_context):
+    """検索対象モデルの追加・更新・削除を search_documents に反映する."""
+    conn = session.connection()
+    dirty = [obj for obj in session.dirty if session.is_modified(obj)]
+    changed = [obj for obj in (*session.new, *dirty) if type(obj) in _DOC_TYPES]
+    deleted = [obj for obj in session.deleted if type(obj) in _DOC_TYPES]
+    if not changed and not deleted:
+        return
+    companies = _document_companies(conn, changed)
+    owners = company_owners(session, set(companies.values()))
+    values = []
+    for obj in changed:
+        company_id = companies[obj]
+        document = _build_document(_DOC_TYPES[type(obj)], obj, company_id, owners.get(company_id))
+        if document:
+            values.append(document)
+    _delete_documents(conn, [(_DOC_TYPES[type(obj)], obj.id) for obj in (*changed, *deleted)])
+    if values:
+        conn.execute(SearchDocument.__table__.insert(), values)
+
+
+# ------------------------------------------------------------------
+# インデックスの作成・再構築
+# ------------------------------------------------------------------
+_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+        tokens, content='search_documents', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+        INSERT INTO search_fts(rowid, tokens) VALUES (new.id, new.tokens);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+        INSERT INTO search_fts(search_fts, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN
+        INSERT INTO search_fts(search_fts, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+        INSERT INTO search_fts(rowid, tokens) VALUES (new.id, new.tokens);
+    END""",
+]
+
+_POSTGRES_DDL = [
+    """CREATE INDEX IF NOT EXISTS ix_search_documents_tsv
+        ON search_documents USING gin (to_tsvector('simple', tokens))""",
+]
+
+
+def init_search():
+    """全文検索インデックス（FTS5 / GIN）を作成する．何度呼んでもよい."""
+    ddl = _SQLITE_DDL if db.engine.dialect.name == "sqlite" else _POSTGRES_DDL
+    with db.engine.begin() as conn:
+        for statement in ddl:
+            conn.execute(text(statement))
+
+
+def _rebuild_sources():
+    """(文書の種類, SELECT) の列．行は本文の列と company_id・user_id（所有者を結合）を持つ."""
+    return [
+        (
+            "company",
+            db.select(
+                Company.id,
+                Company.id.label("company_id"),
+                Company.user_id,
+                Company.name,
+                Company.description,
+                Company.notes,
+            ),
+        ),
+        (
+            "es",
+            db.select(
+                EntrySheet.id,
+                EntrySheet.company_id,
+                Company.user_id,
+                EntrySheet.question,
+                EntrySheet.answer,
+            ).join(Company, EntrySheet.company_id == Company.id),
+        ),
+        (
+            "note",
+            db.select(
+                InterviewNote.id,
+                Selection.company_id,
+                Company.user_id,
+                InterviewNote.question,
+                InterviewNote.answer,
+                InterviewNote.reflection,
+            )
+            .join(Selection, InterviewNote.selection_id == Selection.id)
+            .join(Company, Selection.company_id == Company.id),
+        ),
+        (
+            "selection",
+            db.select(
+                Selection.id,
+                Selection.company_id,
+                Company.user_id,
+                Selection.stage,
+                Selection.feedback,
+            ).join(Company, Selection.company_id == Company.id),
+        ),
+    ]
+
+
+def rebuild_search_index():
+    """search_documents を元データから作り直し，登録した文書数を返す.
+
+    元データは ORM のインスタンスにせず列だけを REBUILD_BATCH_SIZE 件ずつ読み，
+    同じ件数ずつまとめて INSERT する．
+    """
+    table = SearchDocument.__table__
+    db.session.execute(table.delete())
+    conn = db.session.connection()
+    count = 0
+    for doc_type, query in _rebuild_sources():
+        result = conn.execution_options(yield_per=REBUILD_BATCH_SIZE).execute(query)
+        for rows in result.partitions():
+            values = [_build_document(doc_type, row, row.company_id, row.user_id) for row in rows]
+            values = [v for v in values if v]
+            if values:
+                conn.execute(table.insert(), values)
+                count += len(values)
+    db.session.commit()
+    return count
+
+
+# ------------------------------------------------------------------
+# 検索
+# ------------------------------------------------------------------
+def _sqlite_match(terms):
+    """FTS5 の MATCH 式．語は連続 bigram のフレーズ，1 文字の語は前方一致."""
+    parts = []
+    for grams in terms:
+        if len(grams) == 1 and len(grams[0]) == 1:
+            parts.append(f'"{grams[0]}"*')
+        else:
+            parts.append('"' + " ".join(grams) + '"')
+    return " AND ".join(parts)
+
+
+def _search_rows(user_id, terms, limit):
+    """(SearchDocument.id, スコア) をスコアの良い順に返す."""
+    if db.engine.dialect.name == "sqlite":
+        sql = text(
+            """SELECT d.id, bm25(search_fts) AS score
+               FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid
+               WHERE search_fts MATCH :match AND d.user_id = :user_id
+               ORDER BY score LIMIT :limit"""
+        )
+        params = {"match": _sqlite_match(terms), "user_id": user_id, "limit": limit}
+    else:
+        queries = []
+        params = {"user_id": user_id, "limit": limit}
+        for i, grams in enumerate(terms):
+            if len(grams) == 1 and len(grams[0]) == 1:
+                queries.append(f"to_tsquery('simple', :t{i} || ':*')")
+            else:
+                queries.append(f"phraseto_tsquery('simple', :t{i})")
+            params[f"t{i}"] = " ".join(grams)
+        tsquery = " && ".join(queries)
+        sql = text(
+            f"""SELECT id, ts_rank(to_tsvector('simple', tokens), {tsquery}) AS score
+                FROM search_documents
+                WHERE user_id = :user_id AND to_tsvector('simple', tokens) @@ ({tsquery})
+                ORDER BY score DESC LIMIT :limit"""
+        )
+    return db.session.execute(sql, params).all()
+
+
+def _snippet(body, query):
+    """本文中で最初に一致した語の前後を切り出す."""
+    normalized = _normalize(body)
+    pos = -1
+    for word in _WORD_RE.findall(_normalize(query)):
+        pos = normalized.find(word)
+        if pos >= 0:
+            break
+    if pos < 0:
+        return body[: SNIPPET_RADIUS * 2]
+    start = max(pos - SNIPPET_RADIUS, 0)
+    end = min(pos + SNIPPET_RADIUS, len(body))
+    return ("…" if start > 0 else "") + body[start:end] + ("…" if end < len(body) else "")
+
+
+def search(user_id, query, limit=SEARCH_LIMIT):
+    """検索語に一致する文書を関連度順に返す（辞書のリスト）."""
+    terms = _query_terms(query)
+    if not terms:
+        return []
+    ranked = _search_rows(user_id, terms, limit)
+    if not ranked:
+        return []
+
+    ids = [row[0] for row in ranked]
+    rows = db.session.execute(
+        db.select(SearchDocument, Company.name)
+        .outerjoin(Company, Company.id == SearchDocument.company_id)
+        .where(SearchDocument.id.in_(ids))
+    ).all()
+    by_id = {doc.id: (doc, company_name) for doc, company_name in rows}
+
+    results = []
+    for doc_id, score in ranked:
+        doc, company_name = by_id[doc_id]
+        results.append(
+            {
+                "doc_type": doc.doc_type,
+                "doc_id": doc.doc_id,
+                "company_id": doc.company_id,
+                "company_name": company_name or "",
+                "title": doc.title,
+                "snippet": _snippet(doc.body, query),
+                "score": float(score),
+            }
+        )
+    return results
@@ -0,0 +1,28 @@
+// PDF レポート: 作成はバックグラウンドで行われるため，job id の状態をポーリングして完成後にダウンロードする
+(function () {
+    const reportStatus = document.getElementById('reportStatus');
+    async function pollReport(statusUrl) {
+        const res = await fetch(statusUrl, { credentials: 'same-origin' });
+        const job = await res.json();
+        if (job.status === 'pending') {
+            setTimeout(() => pollReport(statusUrl), 1000);
+        } else if (job.status === 'done') {
+            reportStatus.textContent = '';
+            window.location = job.download_url;
+        } else {
+            reportStatus.textContent = job.error;
+        }
+    }
+    document.querySelectorAll('.report-btn').forEach(btn => {
+        btn.addEventListener('click', async () => {
+            reportStatus.textContent = '作成中…';
+            const res = await fetch(btn.dataset.url, { method: 'POST', credentials: 'same-origin' });
+            const job = await res.json();
+            if (res.ok) {
+                pollReport(job.status_url);
+            } else {
+                reportStatus.textContent = job.error;
+            }
+        });
+    });
+})();